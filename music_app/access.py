@@ -0,0 +1,104 @@
+import math
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Music, TrackPopularity
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Flush buffered counts after this many seconds or this many accesses
+    'flush_interval': 30,
+    'flush_threshold': 500,
+    'hot_half_life_hours': 7 * 24,
+    'trend_half_life_hours': 6,
+}
+
+# Scores are measured in half-lives since this fixed point
+SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+_lock = threading.Lock()
+_pending = defaultdict(lambda: [0, 0])  # music id -> [downloads, original downloads]
+_pending_total = 0
+_last_flush = time.monotonic()
+
+
+def get_config():
+    """Access tracking settings merged over the module defaults"""
+    return {**DEFAULTS, **getattr(settings, 'ACCESS_TRACKING', {})}
+
+
+def add_log_score(score, count, now, half_life_hours):
+    """
+    Add count accesses at time now to a log2 decayed score.
+
+    An access at time t is worth 2 ** (t / half_life), so older accesses
+    fade relative to newer ones without any stored value being decayed.
+    """
+    exponent = (now - SCORE_EPOCH).total_seconds() / (half_life_hours * 3600) + math.log2(count)
+    if score is None:
+        return exponent
+    high, low = max(score, exponent), min(score, exponent)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def record_access(music_id, original=False):
+    """Count a download in memory; the database is only written on flush"""
+    global _pending_total
+    config = get_config()
+    with _lock:
+        _pending[music_id][1 if original else 0] += 1
+        _pending_total += 1
+        due = (_pending_total >= config['flush_threshold']
+               or time.monotonic() - _last_flush >= config['flush_interval'])
+    if due:
+        flush()
+
+
+def flush():
+    """Write buffered access counts to TrackPopularity, one row per track"""
+    global _pending, _pending_total, _last_flush
+    with _lock:
+        batch, _pending = _pending, defaultdict(lambda: [0, 0])
+        _pending_total = 0
+        _last_flush = time.monotonic()
+    if not batch:
+        return 0
+
+    config = get_config()
+    now = timezone.now()
+    existing = set(Music.objects.filter(pk__in=list(batch)).values_list('pk', flat=True))
+    for music_id, (downloads, original_downloads) in batch.items():
+        if music_id not in existing:
+            continue
+        total = downloads + original_downloads
+        with transaction.atomic():
+            popularity, _ = TrackPopularity.objects.select_for_update().get_or_create(music_id=music_id)
+            popularity.downloads += downloads
+            popularity.original_downloads += original_downloads
+            popularity.hot_score = add_log_score(popularity.hot_score, total, now, config['hot_half_life_hours'])
+            popularity.trend_score = add_log_score(popularity.trend_score, total, now, config['trend_half_life_hours'])
+            popularity.last_accessed_at = now
+            popularity.save()
+    logger.debug(f"Flushed access counts for {len(batch)} tracks")
+    return len(batch)
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception as e:
+        logger.error(f"Could not flush access counts at exit: {e}")
+
+
+# Don't lose buffered counts when a worker shuts down cleanly
+atexit.register(_flush_at_exit)
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Music
+from .models import Music, ConversionJob, ConversionAttempt, TrackPopularity
+from .search import filter_music
+from .scheduler import enqueue
+from .render_cache import cached_fragment
 from django.utils.html import format_html
 from django.urls import reverse, path
 from django.http import HttpResponseRedirect
@@ -11,6 +14,7 @@ class MusicAdmin(admin.ModelAdmin):
                    'conversion_status', 'uploaded_at', 'converted_at', 'audio_preview', 'admin_actions')
     list_filter = ('original_extension', 'target_extension', 'conversion_status', 'uploaded_at')
     search_fields = ('title', 'artist')
+    actions = ['queue_reconversion']
     readonly_fields = ('uploaded_at', 'converted_at', 'original_name', 'original_extension', 
                       'audio_preview', 'conversion_status', 'error_message')
     fieldsets = (
@@ -33,7 +37,19 @@ class MusicAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of LIKE '%term%' scans. The
+        # changelist applies its own ordering and pagination, so every match
+        # is kept and none are ranked.
+        if not search_term.strip():
+            return queryset, False
+        return filter_music(queryset, search_term), False
+    
     def audio_preview(self, obj):
+        return cached_fragment('admin_audio_preview', obj, self._render_audio_preview)
+    audio_preview.short_description = 'Audio Preview'
+    
+    def _render_audio_preview(self, obj):
         if obj.original_file:
             return format_html(
                 '<audio controls><source src="{}" type="audio/{}">Your browser does not support the audio element.</audio>',
@@ -41,9 +57,12 @@ class MusicAdmin(admin.ModelAdmin):
                 obj.original_extension
             )
         return "No audio file"
-    audio_preview.short_description = 'Audio Preview'
     
     def admin_actions(self, obj):
+        return cached_fragment('admin_actions', obj, self._render_admin_actions)
+    admin_actions.short_description = 'Actions'
+    
+    def _render_admin_actions(self, obj):
         actions = []
         if obj.converted_file and obj.conversion_status == 'success':
             actions.append(
@@ -69,7 +88,12 @@ class MusicAdmin(admin.ModelAdmin):
         )
         
         return format_html(' &nbsp; '.join(actions))
-    admin_actions.short_description = 'Actions'
+    
+    def queue_reconversion(self, request, queryset):
+        for music in queryset:
+            enqueue(music, 'bulk', f'user:{request.user.pk}')
+        self.message_user(request, f'Queued {queryset.count()} files for reconversion', messages.SUCCESS)
+    queue_reconversion.short_description = 'Queue reconversion of selected files'
     
     def get_urls(self):
         urls = super().get_urls()
@@ -89,4 +113,28 @@ class MusicAdmin(admin.ModelAdmin):
         else:
             self.message_user(request, f'Conversion failed: {music.error_message}', messages.ERROR)
         
-        return HttpResponseRedirect(reverse('admin:music_app_music_change', args=[object_id]))
\ No newline at end of file
+        return HttpResponseRedirect(reverse('admin:music_app_music_change', args=[object_id]))
+
+
+@admin.register(ConversionJob)
+class ConversionJobAdmin(admin.ModelAdmin):
+    list_display = ('music', 'target_extension', 'priority_class', 'client', 'size', 'status', 'attempts', 'enqueued_at', 'started_at', 'finished_at')
+    list_filter = ('priority_class', 'status')
+    readonly_fields = ('enqueued_at', 'started_at', 'finished_at')
+
+
+
+@admin.register(ConversionAttempt)
+class ConversionAttemptAdmin(admin.ModelAdmin):
+    list_display = ('music', 'attempt', 'source_extension', 'target_extension', 'outcome', 'duration', 'started_at')
+    list_filter = ('outcome', 'source_extension', 'target_extension')
+    readonly_fields = ('music', 'attempt', 'source_extension', 'target_extension', 'outcome',
+                       'error_message', 'started_at', 'duration')
+
+
+
+@admin.register(TrackPopularity)
+class TrackPopularityAdmin(admin.ModelAdmin):
+    list_display = ('music', 'downloads', 'original_downloads', 'last_accessed_at')
+    ordering = ('-hot_score',)
+    readonly_fields = ('music', 'downloads', 'original_downloads', 'hot_score', 'trend_score', 'last_accessed_at')
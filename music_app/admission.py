@@ -0,0 +1,163 @@
+import math
+import shutil
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ConversionJob
+from .scheduler import async_uploads_enabled
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'enabled': True,
+    # URL names whose POST requests go through admission control
+    'url_names': ['upload_music', 'iphone_upload_api'],
+    # Concurrent uploads across all clients, and per client
+    'max_in_flight': 20,
+    'max_in_flight_per_client': 2,
+    # Queued conversions above which uploads are refused. Only the queue an
+    # upload would join counts, so a bulk reconversion never blocks uploads.
+    'max_backlog': 200,
+    'queue_classes': {'upload_music': 'interactive', 'iphone_upload_api': 'api'},
+    # Conversion workers draining the queue, used to estimate Retry-After
+    'workers': 1,
+    # Assumed seconds per conversion until real timings are available
+    'default_job_seconds': 10,
+    # Free space that must remain on MEDIA_ROOT after the upload is stored
+    'min_free_bytes': 500 * 1024 * 1024,
+    'busy_retry_after': 5,
+    'disk_retry_after': 600,
+    'max_retry_after': 900,
+    # Expiry for in-flight counters, in case a worker dies mid-request
+    'counter_timeout': 600,
+    # Admission runs before authentication, so clients are told apart by
+    # address. Behind a reverse proxy REMOTE_ADDR is the proxy's, so name
+    # the request.META key of the forwarded-for header the proxy sets
+    # (e.g. 'HTTP_X_FORWARDED_FOR') and how many trusted proxies append
+    # to it; the client is that many entries from the end.
+    'client_ip_header': None,
+    'trusted_proxies': 1,
+}
+
+
+def get_config():
+    """Admission settings merged over the module defaults"""
+    return {**DEFAULTS, **getattr(settings, 'UPLOAD_ADMISSION', {})}
+
+
+def client_for_admission(request, config):
+    """Key identifying the uploading client for the per-client limit"""
+    address = request.META.get('REMOTE_ADDR', '')
+    if config['client_ip_header']:
+        forwarded = [part.strip() for part in request.META.get(config['client_ip_header'], '').split(',')
+                     if part.strip()]
+        if len(forwarded) >= config['trusted_proxies'] > 0:
+            address = forwarded[-config['trusted_proxies']]
+    return f'ip:{address}'
+
+
+class Rejection:
+    """Why an upload was refused and when the client should try again"""
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _acquire(key, limit, timeout):
+    """Increment a shared counter, undoing it and returning False if over limit"""
+    cache.add(key, 0, timeout)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Key expired between add and incr
+        cache.add(key, 1, timeout)
+        count = 1
+    # Keep a busy counter alive; it should only expire once traffic stops
+    cache.touch(key, timeout)
+    if count > limit:
+        release(key)
+        return False
+    return True
+
+
+def release(key):
+    try:
+        count = cache.decr(key)
+    except ValueError:
+        return
+    if count < 0:
+        # The counter expired and restarted under in-flight uploads
+        cache.incr(key, -count)
+
+
+def average_job_seconds(config):
+    """Mean conversion time over the last hour of finished jobs"""
+    since = timezone.now() - timedelta(hours=1)
+    durations = [
+        duration.total_seconds()
+        for duration in ConversionJob.objects
+        .filter(finished_at__gte=since, started_at__isnull=False)
+        .annotate(duration=F('finished_at') - F('started_at'))
+        .values_list('duration', flat=True)[:100]
+    ]
+    return sum(durations) / len(durations) if durations else config['default_job_seconds']
+
+
+def check_resources(request, config, url_name=None):
+    """Refuse the upload if disk space or the conversion backlog is exhausted"""
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    try:
+        free = shutil.disk_usage(settings.MEDIA_ROOT).free
+    except OSError:
+        free = None
+    if free is not None and free - content_length < config['min_free_bytes']:
+        logger.warning(f"Refusing upload: {free} bytes free on MEDIA_ROOT")
+        return Rejection(503, 'Server storage is nearly full.', config['disk_retry_after'])
+
+    priority_class = config['queue_classes'].get(url_name)
+    if priority_class is None or not async_uploads_enabled():
+        # Converted inline, so the upload never waits on the queue
+        return None
+    backlog = ConversionJob.objects.filter(status='queued', priority_class=priority_class).count()
+    if backlog >= config['max_backlog']:
+        excess = backlog - config['max_backlog'] + 1
+        seconds = excess * average_job_seconds(config) / max(config['workers'], 1)
+        retry_after = min(config['max_retry_after'], max(1, math.ceil(seconds)))
+        return Rejection(503, 'Too many conversions are waiting.', retry_after)
+    return None
+
+
+def admit(request, url_name=None):
+    """
+    Decide whether an upload may proceed, before its body is read.
+
+    Returns (rejection, keys): rejection is None when the upload is admitted,
+    and keys are the in-flight counters to release once it completes.
+    """
+    config = get_config()
+    timeout = config['counter_timeout']
+    global_key = 'upload_admission:in_flight'
+    client_key = f'upload_admission:in_flight:{client_for_admission(request, config)}'
+
+    if not _acquire(client_key, config['max_in_flight_per_client'], timeout):
+        return Rejection(429, 'Too many uploads in progress from this client.', config['busy_retry_after']), []
+    if not _acquire(global_key, config['max_in_flight'], timeout):
+        release(client_key)
+        return Rejection(503, 'Too many uploads in progress.', config['busy_retry_after']), []
+
+    rejection = check_resources(request, config, url_name)
+    if rejection:
+        release(global_key)
+        release(client_key)
+        return rejection, []
+    return None, [global_key, client_key]
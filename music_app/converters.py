@@ -2,21 +2,142 @@ import os
 import tempfile
 from io import BytesIO
 import subprocess
+import hashlib
+import json
+import struct
 import logging
+import importlib.util
+
+import numpy as np
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def convert_audio_with_ffmpeg(input_path, output_format):
+# FFmpeg encoder arguments for each output format (MP3 is the default)
+FFMPEG_CODEC_ARGS = {
+    'mp3': [
+        '-codec:a', 'libmp3lame',
+        '-qscale:a', '2',  # Good quality (0-9, 0 is best)
+    ],
+    'wav': [
+        '-codec:a', 'pcm_s16le',
+    ],
+    'ogg': [
+        '-codec:a', 'libvorbis',
+        '-qscale:a', '5',  # Good quality (0-10, 10 is best)
+    ],
+    'flac': [
+        '-codec:a', 'flac',
+        '-compression_level', '5',  # Medium compression (0-12, 12 is max)
+    ],
+    'm4a': [
+        '-codec:a', 'aac',
+        '-b:a', '192k',  # Bitrate
+    ],
+    'aac': [
+        '-codec:a', 'aac',
+        '-b:a', '192k',
+    ],
+}
+
+# pydub export arguments for each output format (MP3 is the default)
+PYDUB_EXPORT_ARGS = {
+    'mp3': {'format': 'mp3', 'bitrate': '192k'},
+    'wav': {'format': 'wav'},
+    'ogg': {'format': 'ogg', 'bitrate': '192k'},
+    'flac': {'format': 'flac'},
+    'm4a': {'format': 'ipod'},  # pydub uses 'ipod' for m4a/aac
+    'aac': {'format': 'ipod'},
+}
+
+def conversion_method(input_path, output_format):
+    """Name and encoder settings of the converter convert_audio will use first"""
+    if can_convert_in_process(input_path, output_format):
+        return 'in_process', {'samples': 'unchanged'}
+    if importlib.util.find_spec('pydub') is not None:
+        return 'pydub', PYDUB_EXPORT_ARGS.get(output_format, PYDUB_EXPORT_ARGS['mp3'])
+    return 'ffmpeg', FFMPEG_CODEC_ARGS.get(output_format, FFMPEG_CODEC_ARGS['mp3'])
+
+def conversion_settings_key(output_format, input_path):
     """
-    Convert audio file to the specified format using FFmpeg directly
+    Short digest of the converter and encoder settings that will produce
+    output_format from input_path, so two conversions can be recognised as
+    producing the same result
     """
+    method, args = conversion_method(input_path, output_format)
+    return hashlib.sha1(json.dumps([output_format, method, args]).encode()).hexdigest()[:16]
+
+class ConversionError(Exception):
+    """A failed conversion, classified so callers can decide whether to retry"""
+    CORRUPT_INPUT = 'corrupt_input'
+    UNSUPPORTED_CODEC = 'unsupported_codec'
+    TRANSIENT = 'transient'
+    UNKNOWN = 'unknown'
+    
+    def __init__(self, message, kind=UNKNOWN, returncode=None, stderr=''):
+        super().__init__(message)
+        self.kind = kind
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+# FFmpeg stderr fragments that identify each kind of failure
+FAILURE_PATTERNS = [
+    (ConversionError.TRANSIENT, [
+        'no space left on device',
+        'cannot allocate memory',
+        'resource temporarily unavailable',
+        'too many open files',
+        'disk quota exceeded',
+    ]),
+    (ConversionError.UNSUPPORTED_CODEC, [
+        'unknown encoder',
+        'encoder not found',
+        'decoder not found',
+        'unsupported codec',
+        'not currently supported in this container',
+        'unable to find a suitable output format',
+        'no decoder for codec',
+    ]),
+    (ConversionError.CORRUPT_INPUT, [
+        'invalid data found when processing input',
+        'moov atom not found',
+        'could not find codec parameters',
+        'header missing',
+        'error while decoding',
+        'does not contain any stream',
+    ]),
+]
+
+# Exit statuses of an FFmpeg killed by SIGKILL (e.g. the OOM killer) or
+# SIGTERM, as reported directly and through a shell
+KILLED_RETURNCODES = {-9, -15, 137, 143}
+
+def classify_failure(returncode, stderr):
+    """Classify an FFmpeg failure from its exit status and stderr"""
+    if returncode is not None and (returncode < 0 or returncode in KILLED_RETURNCODES):
+        return ConversionError.TRANSIENT
+    text = (stderr or '').lower()
+    for kind, patterns in FAILURE_PATTERNS:
+        if any(pattern in text for pattern in patterns):
+            return kind
+    return ConversionError.UNKNOWN
+
+def _last_line(stderr):
+    lines = [line for line in (stderr or '').strip().splitlines() if line.strip()]
+    return lines[-1] if lines else 'no error output'
+
+def run_ffmpeg_conversion(input_path, output_format):
+    """
+    Convert audio file to the specified format using FFmpeg, raising
+    ConversionError with a failure classification if it does not succeed
+    """
+    # Validate input file exists
+    if not os.path.exists(input_path):
+        raise ConversionError(f"Input file does not exist: {input_path}", ConversionError.CORRUPT_INPUT)
+    
+    output_path = None
     try:
-        # Validate input file exists
-        if not os.path.exists(input_path):
-            logger.error(f"Input file does not exist: {input_path}")
-            return None
-        
         # Create a temporary file to store the converted audio
         with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{output_format}') as tmp:
             output_path = tmp.name
@@ -29,78 +150,48 @@ def convert_audio_with_ffmpeg(input_path, output_format):
         ]
         
         # Add format-specific parameters
-        if output_format == 'mp3':
-            ffmpeg_cmd.extend([
-                '-codec:a', 'libmp3lame',
-                '-qscale:a', '2',  # Good quality (0-9, 0 is best)
-            ])
-        elif output_format == 'wav':
-            ffmpeg_cmd.extend([
-                '-codec:a', 'pcm_s16le',
-            ])
-        elif output_format == 'ogg':
-            ffmpeg_cmd.extend([
-                '-codec:a', 'libvorbis',
-                '-qscale:a', '5',  # Good quality (0-10, 10 is best)
-            ])
-        elif output_format == 'flac':
-            ffmpeg_cmd.extend([
-                '-codec:a', 'flac',
-                '-compression_level', '5',  # Medium compression (0-12, 12 is max)
-            ])
-        elif output_format in ['m4a', 'aac']:
-            ffmpeg_cmd.extend([
-                '-codec:a', 'aac',
-                '-b:a', '192k',  # Bitrate
-            ])
-        else:
-            # Default to MP3
-            ffmpeg_cmd.extend([
-                '-codec:a', 'libmp3lame',
-                '-qscale:a', '2',
-            ])
+        ffmpeg_cmd.extend(FFMPEG_CODEC_ARGS.get(output_format, FFMPEG_CODEC_ARGS['mp3']))
         
         # Add output file to command
         ffmpeg_cmd.append(output_path)
         
         # Run FFmpeg command
-        result = subprocess.run(
-            ffmpeg_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        try:
+            result = subprocess.run(
+                ffmpeg_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+        except FileNotFoundError:
+            raise ConversionError("FFmpeg is not installed or not found in PATH")
         
         # Check if conversion was successful
         if result.returncode != 0:
-            logger.error(f"FFmpeg conversion failed: {result.stderr}")
-            if os.path.exists(output_path):
-                os.unlink(output_path)
-            return None
+            kind = classify_failure(result.returncode, result.stderr)
+            raise ConversionError(
+                f"FFmpeg exited with status {result.returncode}: {_last_line(result.stderr)}",
+                kind, result.returncode, result.stderr
+            )
         
         # Read the converted data
         with open(output_path, 'rb') as f:
             converted_data = BytesIO(f.read())
             converted_data.seek(0)
         
-        # Clean up temporary file
-        os.unlink(output_path)
-        
         return converted_data
-            
-    except FileNotFoundError:
-        logger.error("FFmpeg is not installed or not found in PATH")
-        return None
-    except Exception as e:
-        logger.error(f"Error converting audio with FFmpeg: {e}")
-        # Clean up temporary file if it exists
-        if 'output_path' in locals() and os.path.exists(output_path):
+    
+    except (MemoryError, OSError) as e:
+        # Out of memory, disk space or file descriptors while preparing or
+        # reading the output
+        raise ConversionError(f"Resource error during conversion: {e}", ConversionError.TRANSIENT)
+    finally:
+        # Clean up temporary file
+        if output_path and os.path.exists(output_path):
             try:
                 os.unlink(output_path)
-            except:
+            except OSError:
                 pass
-        return None
-
 
 # Alternative implementation using pydub (even simpler)
 def convert_audio_with_pydub(input_path, output_format):
@@ -114,19 +205,7 @@ def convert_audio_with_pydub(input_path, output_format):
         audio = AudioSegment.from_file(input_path)
         
         # Export to the desired format
-        if output_format == 'mp3':
-            converted_data = audio.export(format='mp3', bitrate='192k')
-        elif output_format == 'wav':
-            converted_data = audio.export(format='wav')
-        elif output_format == 'ogg':
-            converted_data = audio.export(format='ogg', bitrate='192k')
-        elif output_format == 'flac':
-            converted_data = audio.export(format='flac')
-        elif output_format in ['m4a', 'aac']:
-            converted_data = audio.export(format='ipod')  # pydub uses 'ipod' for m4a/aac
-        else:
-            # Default to MP3
-            converted_data = audio.export(format='mp3', bitrate='192k')
+        converted_data = audio.export(**PYDUB_EXPORT_ARGS.get(output_format, PYDUB_EXPORT_ARGS['mp3']))
         
         # Return the data as BytesIO
         converted_bytes = BytesIO(converted_data.read())
@@ -143,15 +222,132 @@ def convert_audio_with_pydub(input_path, output_format):
         return None
 
 
+# In-process fast path for PCM WAV input and WAV output
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+FAST_PATH_BLOCK_FRAMES = 1 << 18  # frames copied per block
+
+def read_wav_header(input_path):
+    """
+    Parse the fmt and data chunks of a WAV file.
+    
+    Returns a dict with format, channels, sample_rate, bits, data_offset
+    and data_size, or None if the file is not a WAV NumPy can read directly.
+    """
+    try:
+        file_size = os.path.getsize(input_path)
+        with open(input_path, 'rb') as f:
+            riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave_id != b'WAVE':
+                return None
+            header = None
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return None
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+                if chunk_id == b'fmt ':
+                    fmt = f.read(chunk_size)
+                    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+                    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                        # First two bytes of the sub-format GUID hold the real format
+                        format_tag = struct.unpack('<H', fmt[24:26])[0]
+                    header = {
+                        'format': format_tag,
+                        'channels': channels,
+                        'sample_rate': sample_rate,
+                        'bits': bits,
+                        'block_align': block_align,
+                    }
+                    f.seek(chunk_size % 2, os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    if header is None:
+                        return None
+                    data_offset = f.tell()
+                    # Streamed WAVs may leave the size unset or too large
+                    data_size = min(chunk_size, file_size - data_offset)
+                    header['data_offset'] = data_offset
+                    header['data_size'] = data_size - data_size % max(header['block_align'], 1)
+                    return header
+                else:
+                    f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+def can_convert_in_process(input_path, output_format):
+    """True if the in-process WAV fast path can handle this conversion"""
+    if output_format != 'wav' or not input_path.lower().endswith('.wav'):
+        return False
+    header = read_wav_header(input_path)
+    if header is None or header['channels'] < 1:
+        return False
+    if header['block_align'] != header['channels'] * header['bits'] // 8:
+        return False
+    if header['format'] == WAVE_FORMAT_PCM:
+        return header['bits'] in (8, 16, 24, 32)
+    if header['format'] == WAVE_FORMAT_IEEE_FLOAT:
+        return header['bits'] in (32, 64)
+    return False
+
+def _wav_header(header, data_size):
+    """Canonical WAV header for data_size bytes in the source's sample format"""
+    channels, bits, sample_rate = header['channels'], header['bits'], header['sample_rate']
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', header['format'], channels, sample_rate,
+                      sample_rate * block_align, block_align, bits)
+    fact = b''
+    if header['format'] == WAVE_FORMAT_IEEE_FLOAT:
+        # Non-PCM formats carry a cbSize field and a fact chunk
+        fmt += struct.pack('<H', 0)
+        fact = struct.pack('<4sII', b'fact', 4, data_size // block_align)
+    body = (b'WAVE' + struct.pack('<4sI', b'fmt ', len(fmt)) + fmt + fact
+            + struct.pack('<4sI', b'data', data_size))
+    return struct.pack('<4sI', b'RIFF', len(body) + data_size + data_size % 2) + body
+
+def convert_wav_in_process(input_path, output_format='wav'):
+    """
+    Rewrite a PCM or float WAV as a canonical WAV without spawning FFmpeg.
+    
+    Samples are copied unchanged, so bit depth, sample rate and channel
+    layout are all kept; only the container is rebuilt, dropping extra
+    chunks. The input is memory-mapped and written in blocks, so only one
+    block is ever held in memory.
+    """
+    header = read_wav_header(input_path)
+    data_size = header['data_size']
+    
+    output = tempfile.TemporaryFile(suffix=f'.{output_format}')
+    output.write(_wav_header(header, data_size))
+    if data_size:
+        data = np.memmap(input_path, dtype=np.uint8, mode='r', offset=header['data_offset'], shape=(data_size,))
+        block = FAST_PATH_BLOCK_FRAMES * header['block_align']
+        for start in range(0, data_size, block):
+            output.write(memoryview(data[start:start + block]))
+        del data
+        if data_size % 2:
+            # RIFF chunks are padded to an even length
+            output.write(b'\0')
+    output.seek(0)
+    return output
+
+
 # Main converter function that tries both methods
 def convert_audio(input_path, output_format):
     """
     Convert audio file using the best available method
     """
+    # PCM WAV to WAV needs no decoder or encoder; do it in-process
+    if can_convert_in_process(input_path, output_format):
+        try:
+            return convert_wav_in_process(input_path, output_format)
+        except Exception as e:
+            logger.warning(f"In-process WAV conversion failed, falling back: {e}")
+    
     # First try pydub (lightweight)
     result = convert_audio_with_pydub(input_path, output_format)
     if result:
         return result
     
-    # Fall back to FFmpeg if pydub fails
-    return convert_audio_with_ffmpeg(input_path, output_format)
\ No newline at end of file
+    # Fall back to FFmpeg if pydub fails, letting its classified error through
+    return run_ffmpeg_conversion(input_path, output_format)
\ No newline at end of file
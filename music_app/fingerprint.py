@@ -0,0 +1,257 @@
+import os
+import subprocess
+import wave
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+
+from .models import AudioFingerprint, FingerprintHash
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Analysis parameters. Changing any of these invalidates stored fingerprints.
+SAMPLE_RATE = 8000
+FRAME_SIZE = 2048           # 256ms analysis window
+HOP_SIZE = 256              # 32ms between sub-fingerprints
+BAND_EDGES_HZ = np.geomspace(300, 2000, 34)
+READ_CHUNK = 64 * 1024      # bytes of PCM read from the decoder at a time
+
+_BIN_EDGES = np.round(BAND_EDGES_HZ * FRAME_SIZE / SAMPLE_RATE).astype(int)
+_WINDOW = np.hanning(FRAME_SIZE).astype(np.float32)
+_BIT_WEIGHTS = (np.uint64(1) << np.arange(32, dtype=np.uint64))
+KEY_MASK = 0xFFFFFF
+
+DEFAULTS = {
+    'enabled': True,
+    'max_seconds': 120,         # only the start of each track is analysed
+    'index_limit': 200,         # indexed keys per track
+    'query_limit': 500,         # keys looked up per query
+    'max_bit_error_rate': 0.35,
+    'min_overlap_seconds': 5,
+    'candidates': 5,
+}
+
+
+def get_config():
+    """Fingerprint settings merged over the module defaults"""
+    return {**DEFAULTS, **getattr(settings, 'AUDIO_FINGERPRINT', {})}
+
+
+def _stream_pcm_ffmpeg(input_path, max_seconds):
+    """Yield mono int16 sample chunks decoded and resampled by FFmpeg"""
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-i', input_path, '-t', str(max_seconds),
+         '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        leftover = b''
+        while True:
+            data = process.stdout.read(READ_CHUNK)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % 2
+            leftover = data[usable:]
+            yield np.frombuffer(data[:usable], dtype='<i2')
+    finally:
+        process.stdout.close()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f'FFmpeg exited with status {process.returncode}')
+
+
+def _stream_pcm_wave(input_path, max_seconds):
+    """Yield mono int16 sample chunks from a 16-bit PCM WAV without FFmpeg"""
+    with wave.open(input_path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError('Only 16-bit PCM WAV files can be read without FFmpeg')
+        channels = wav.getnchannels()
+        step = wav.getframerate() / SAMPLE_RATE
+        remaining = int(max_seconds * wav.getframerate())
+        position = 0.0      # next output sample, in input sample units
+        consumed = 0        # input samples seen before the current chunk
+        previous = np.zeros(0, dtype=np.float32)
+        while remaining > 0:
+            raw = wav.readframes(min(remaining, READ_CHUNK // (2 * channels)))
+            if not raw:
+                break
+            samples = np.frombuffer(raw, dtype='<i2').reshape(-1, channels).mean(axis=1, dtype=np.float32)
+            remaining -= len(samples)
+            # Keep the last sample of the previous chunk so interpolation
+            # is continuous across chunk boundaries.
+            block = np.concatenate([previous, samples])
+            start = consumed - len(previous)
+            end = consumed + len(samples) - 1
+            if position <= end:
+                targets = np.arange(position, end + 1e-9, step)
+                position = targets[-1] + step
+                yield np.interp(targets - start, np.arange(len(block)), block).astype(np.int16)
+            consumed += len(samples)
+            previous = samples[-1:]
+
+
+def stream_pcm(input_path, max_seconds):
+    """Stream mono PCM at SAMPLE_RATE, falling back to the wave module for WAV input"""
+    try:
+        yield from _stream_pcm_ffmpeg(input_path, max_seconds)
+    except FileNotFoundError:
+        if os.path.splitext(input_path)[1].lower() != '.wav':
+            raise
+        logger.info("FFmpeg not found, decoding WAV with the wave module")
+        yield from _stream_pcm_wave(input_path, max_seconds)
+
+
+def compute_fingerprint(chunks):
+    """
+    Compute 32-bit sub-fingerprints from an iterable of int16 sample chunks.
+
+    Each bit is the sign of the change, between consecutive frames, of the
+    energy difference between two adjacent frequency bands. Frames are
+    processed in vectorized batches as chunks arrive, so memory stays bounded
+    by the chunk size rather than the track length.
+    """
+    buffer = np.zeros(0, dtype=np.float32)
+    previous = None
+    words = []
+    for chunk in chunks:
+        buffer = np.concatenate([buffer, chunk.astype(np.float32)])
+        if len(buffer) < FRAME_SIZE:
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, FRAME_SIZE)[::HOP_SIZE]
+        spectrum = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)) ** 2
+        energy = np.add.reduceat(spectrum, _BIN_EDGES, axis=1)[:, :33]
+        diff = energy[:, :-1] - energy[:, 1:]
+        if previous is not None:
+            diff = np.vstack([previous, diff])
+        bits = (diff[1:] - diff[:-1]) > 0
+        words.append((bits.astype(np.uint64) @ _BIT_WEIGHTS).astype(np.uint32))
+        previous = diff[-1:]
+        buffer = buffer[len(frames) * HOP_SIZE:]
+    if not words:
+        return np.zeros(0, dtype=np.uint32)
+    return np.concatenate(words)
+
+
+def index_keys(words):
+    """
+    Derive index keys from sub-fingerprints.
+
+    A key is the 24 lowest-band bits of a sub-fingerprint, which survive
+    re-encoding far more often than all 32 bits. Only keys whose hash falls
+    in one quarter of the key space are kept; the choice depends on the key
+    alone, so two encodings of the same audio keep the same keys even when
+    they are slightly misaligned. Silent frames are never kept.
+    Returns (positions, keys).
+    """
+    keys = words & np.uint32(KEY_MASK)
+    mixed = (keys.astype(np.uint64) * np.uint64(0x9E3779B1)) & np.uint64(0xFFFFFFFF)
+    keep = ((mixed >> np.uint64(30)) == 0) & (keys != 0) & (keys != KEY_MASK)
+    positions = np.flatnonzero(keep)
+    return positions, keys[positions].astype(np.int64)
+
+
+def bit_error_rate(a, b, offset):
+    """Fraction of differing bits between a and b with b shifted by offset frames"""
+    if offset >= 0:
+        a = a[offset:]
+    else:
+        b = b[-offset:]
+    length = min(len(a), len(b))
+    if length == 0:
+        return 1.0, 0
+    xor = np.bitwise_xor(a[:length], b[:length])
+    return np.unpackbits(xor.view(np.uint8)).sum() / (length * 32), length
+
+
+def fingerprint_music(music):
+    """Compute and index the fingerprint of a Music row's original file"""
+    config = get_config()
+    if not config['enabled'] or not music.original_file:
+        return None
+    try:
+        words = compute_fingerprint(stream_pcm(music.original_file.path, config['max_seconds']))
+    except Exception as e:
+        logger.warning(f"Could not fingerprint {music.original_file.name}: {e}")
+        return None
+    if len(words) == 0:
+        return None
+
+    AudioFingerprint.objects.filter(music=music).delete()
+    fingerprint = AudioFingerprint.objects.create(
+        music=music,
+        frame_count=len(words),
+        data=words.tobytes(),
+    )
+    positions, keys = index_keys(words)
+    limit = config['index_limit']
+    FingerprintHash.objects.bulk_create([
+        FingerprintHash(fingerprint=fingerprint, value=int(key), offset=int(position))
+        for position, key in zip(positions[:limit], keys[:limit])
+    ])
+    return fingerprint
+
+
+def find_duplicate(fingerprint):
+    """
+    Find a successfully converted track that sounds the same as fingerprint.
+
+    Candidates come from the indexed keys, so only tracks sharing keys are
+    ever loaded. Each candidate is verified by the bit error
+    rate at the most common alignment of the shared keys.
+    """
+    config = get_config()
+    music = fingerprint.music
+    words = np.frombuffer(bytes(fingerprint.data), dtype=np.uint32)
+    positions, keys = index_keys(words)
+    query = {}
+    for position, key in zip(positions, keys):
+        if len(query) >= config['query_limit'] and int(key) not in query:
+            break
+        query.setdefault(int(key), []).append(int(position))
+    if not query:
+        return None
+
+    candidates = (
+        FingerprintHash.objects
+        .filter(
+            value__in=list(query),
+            fingerprint__music__target_extension=music.target_extension,
+            fingerprint__music__conversion_status='success',
+        )
+        .exclude(fingerprint__music=music)
+        .exclude(fingerprint__music__converted_file='')
+        .exclude(fingerprint__music__converted_file__isnull=True)
+        .values('fingerprint')
+        .annotate(votes=Count('id'))
+        .filter(votes__gte=2)
+        .order_by('-votes')[:config['candidates']]
+    )
+    min_overlap = config['min_overlap_seconds'] * SAMPLE_RATE // HOP_SIZE
+    for candidate in candidates:
+        other = AudioFingerprint.objects.select_related('music').get(pk=candidate['fingerprint'])
+        other_words = np.frombuffer(bytes(other.data), dtype=np.uint32)
+        hashes = FingerprintHash.objects.filter(fingerprint=other, value__in=list(query))
+        shifts = [position - h.offset for h in hashes for position in query[h.value]]
+        shift = max(set(shifts), key=shifts.count)
+        error, overlap = min(
+            bit_error_rate(words, other_words, s) for s in range(shift - 2, shift + 3)
+        )
+        if overlap >= min(min_overlap, len(words)) and error <= config['max_bit_error_rate']:
+            logger.info(f"{music} matches {other.music} (bit error rate {error:.3f})")
+            return other.music
+    return None
+
+
+def reuse_duplicate_conversion(music):
+    """Fingerprint a new upload and reuse the conversion of a matching track"""
+    fingerprint = fingerprint_music(music)
+    if fingerprint:
+        duplicate = find_duplicate(fingerprint)
+        if duplicate:
+            return music.reuse_conversion_from(duplicate)
+    return False
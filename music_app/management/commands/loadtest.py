@@ -0,0 +1,243 @@
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+import wave
+from collections import defaultdict
+from http.cookiejar import CookieJar
+from urllib import request as urllib_request
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+
+ENDPOINTS = ('music_list', 'upload_music', 'iphone_raw', 'iphone_multipart', 'convert_music', 'download_music')
+DEFAULT_MIX = 'music_list=5,upload_music=1,iphone_raw=1,iphone_multipart=1,convert_music=1,download_music=2'
+
+
+def synthetic_wav(seconds, sample_rate=22050):
+    """A mono sine sweep, so every upload is a valid, non-silent audio file"""
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        value = int(12000 * math.sin(2 * math.pi * (220 + 110 * t) * t))
+        frames += value.to_bytes(2, 'little', signed=True)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, data) files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: audio/wav\r\n\r\n'.encode()
+        )
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class NoRedirect(urllib_request.HTTPRedirectHandler):
+    """Report redirects instead of following them, so each request is timed alone"""
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Client:
+    """One simulated user with its own cookies and CSRF token"""
+    def __init__(self, base_url, timeout, audio, target_format, known_ids):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.audio = audio
+        self.target_format = target_format
+        self.known_ids = known_ids
+        self.cookies = CookieJar()
+        self.opener = urllib_request.build_opener(urllib_request.HTTPCookieProcessor(self.cookies), NoRedirect)
+
+    def send(self, path, data=None, headers=None):
+        """Return (status, body); 3xx responses count as completed requests"""
+        req = urllib_request.Request(self.base_url + path, data=data, headers=headers or {})
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        self.send('/upload/')
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def remember_id(self, body):
+        try:
+            music_id = json.loads(body).get('id')
+        except ValueError:
+            return
+        if music_id:
+            self.known_ids.append(music_id)
+
+    def pick_id(self):
+        return random.choice(self.known_ids) if self.known_ids else None
+
+    def music_list(self):
+        return self.send('/')
+
+    def upload_music(self):
+        token = self.csrf_token()
+        body, content_type = multipart(
+            {'csrfmiddlewaretoken': token, 'title': 'Load test', 'artist': 'loadtest',
+             'target_extension': self.target_format},
+            [('original_file', 'loadtest.wav', self.audio)],
+        )
+        return self.send('/upload/', body, {'Content-Type': content_type, 'X-CSRFToken': token,
+                                            'Referer': self.base_url + '/upload/'})
+
+    def iphone_raw(self):
+        status, body = self.send('/api/iphone-upload/', self.audio, {
+            'Content-Type': 'audio/wav',
+            'X-Title': 'Load test',
+            'X-Artist': 'loadtest',
+            'X-Format': self.target_format,
+            'X-Filename': f'loadtest_{uuid.uuid4().hex[:8]}.wav',
+        })
+        self.remember_id(body)
+        return status, body
+
+    def iphone_multipart(self):
+        """
+        A multipart form post, as some iOS clients send. iphone_upload_api only
+        parses urlencoded forms, so the whole multipart body is stored as a raw
+        upload; this measures what such clients cost today, not a form upload.
+        """
+        body, content_type = multipart(
+            {'title': 'Load test', 'artist': 'loadtest', 'target_extension': self.target_format},
+            [('original_file', 'loadtest.wav', self.audio)],
+        )
+        status, body = self.send('/api/iphone-upload/', body, {'Content-Type': content_type})
+        self.remember_id(body)
+        return status, body
+
+    def convert_music(self):
+        music_id = self.pick_id()
+        if music_id is None:
+            return self.iphone_raw()
+        token = self.csrf_token()
+        body = urlencode({'csrfmiddlewaretoken': token, 'target_extension': self.target_format}).encode()
+        return self.send(f'/convert/{music_id}/', body, {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Referer': self.base_url + f'/convert/{music_id}/',
+        })
+
+    def download_music(self):
+        music_id = self.pick_id()
+        if music_id is None:
+            return self.music_list()
+        return self.send(f'/download/{music_id}/')
+
+
+class Command(BaseCommand):
+    help = 'Drive a running server with a mix of requests and report latency per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running server')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument('--concurrency', type=int, default=8, help='Simultaneous simulated clients')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Comma-separated endpoint=weight pairs (default: {DEFAULT_MIX})')
+        parser.add_argument('--audio-seconds', type=float, default=3, help='Length of the synthetic upload')
+        parser.add_argument('--target-format', default='mp3', help='Format requested for conversions')
+        parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+
+    def parse_mix(self, mix):
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in ENDPOINTS:
+                raise CommandError(f'Unknown endpoint in --mix: {name}')
+            try:
+                weights[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f'Invalid weight for {name}: {weight}')
+        return weights
+
+    def handle(self, *args, **options):
+        weights = self.parse_mix(options['mix'])
+        names, weight_values = list(weights), list(weights.values())
+        audio = synthetic_wav(options['audio_seconds'])
+        known_ids = []
+        results = defaultdict(list)  # endpoint -> [(latency, status)]
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def run_client():
+            client = Client(options['url'], options['timeout'], audio, options['target_format'], known_ids)
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights=weight_values)[0]
+                started = time.perf_counter()
+                try:
+                    status, _ = getattr(client, name)()
+                except (URLError, OSError) as e:
+                    status = f'error: {getattr(e, "reason", e)}'
+                latency = time.perf_counter() - started
+                with lock:
+                    results[name].append((latency, status))
+
+        self.stdout.write(
+            f'Running {options["concurrency"]} clients against {options["url"]} '
+            f'for {options["duration"]:.0f}s ({len(audio)} byte uploads)'
+        )
+        started = time.monotonic()
+        threads = [threading.Thread(target=run_client, daemon=True) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.report(results, time.monotonic() - started)
+
+    def report(self, results, elapsed):
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"endpoint":<16} {"requests":>9} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} '
+            f'{"p99 ms":>9} {"errors":>7} {"rejected":>9}'
+        )
+        total = 0
+        for name in sorted(results):
+            samples = results[name]
+            latencies = sorted(latency * 1000 for latency, _ in samples)
+            rejected = sum(1 for _, status in samples if status in (429, 503))
+            errors = sum(1 for _, status in samples
+                         if not isinstance(status, int) or (status >= 400 and status not in (429, 503)))
+            total += len(samples)
+            self.stdout.write(
+                f'{name:<16} {len(samples):>9} {len(samples) / elapsed:>8.1f} '
+                f'{percentile(latencies, 0.50):>9.1f} {percentile(latencies, 0.95):>9.1f} '
+                f'{percentile(latencies, 0.99):>9.1f} {errors / len(samples):>7.1%} {rejected / len(samples):>9.1%}'
+            )
+        self.stdout.write(f'\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)')
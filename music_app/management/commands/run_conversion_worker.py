@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music_app.scheduler import claim_next_job, run_job, queue_stats, requeue_stale_jobs, retry_stats
+
+
+class Command(BaseCommand):
+    help = 'Run queued conversion jobs in priority order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stats', action='store_true', help='Print queue statistics and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        while True:
+            requeue_stale_jobs()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            self.stdout.write(f'Running {job} ({job.size} bytes, client {job.client or "-"})')
+            if run_job(job):
+                self.stdout.write(self.style.SUCCESS(f'Converted {job.music}'))
+            else:
+                self.stdout.write(self.style.ERROR(f'Failed {job.music}: {job.music.error_message}'))
+
+    def print_stats(self):
+        self.stdout.write(f'{"class":<12} {"queued":>7} {"running":>8} {"oldest":>9} {"avg wait":>9} {"max wait":>9}')
+        for priority_class, row in queue_stats().items():
+            self.stdout.write(
+                f'{priority_class:<12} {row["queued"]:>7} {row["running"]:>8} '
+                f'{row["oldest_wait"]:>8.0f}s {row["avg_wait"]:>8.1f}s {row["max_wait"]:>8.1f}s'
+            )
+
+        self.stdout.write('')
+        self.stdout.write(f'{"formats":<12} {"attempts":>9} {"retries":>8} {"transient":>10} {"retry rate":>11}')
+        for row in retry_stats():
+            pair = f'{row["source_extension"]}->{row["target_extension"]}'
+            self.stdout.write(
+                f'{pair:<12} {row["attempts"]:>9} {row["retries"]:>8} '
+                f'{row["transient"]:>10} {row["retry_rate"]:>10.1%}'
+            )
@@ -0,0 +1,146 @@
+import os
+from datetime import timedelta
+from itertools import zip_longest
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Q, F
+from django.utils import timezone
+
+from music_app.access import flush
+from music_app.models import Music
+
+DEFAULTS = {
+    # Local hours [start, end) during which warming may run; a start after
+    # the end wraps past midnight, e.g. (22, 5)
+    'off_peak_hours': (1, 6),
+    # CPU seconds (this process plus FFmpeg children) one run may spend
+    'cpu_seconds': 600,
+    # Total size of converted files to stay under
+    'max_storage_bytes': 5 * 1024 ** 3,
+    # Tracks considered for warming per run, from each of hot and trending
+    'candidates': 50,
+    # Renditions not downloaded for this long are evicted
+    'cold_days': 30,
+    # When download tracking began; defaults to when the TrackPopularity
+    # migration was applied. A track with no popularity row is only known
+    # to be cold once tracking has run for cold_days.
+    'tracking_started': None,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RENDITION_WARMING', {})}
+
+
+def tracking_started(config):
+    """When download counts started being recorded, or None if unknown"""
+    if config['tracking_started'] is not None:
+        return config['tracking_started']
+    return (MigrationRecorder.Migration.objects
+            .filter(app='music_app', name='0007_track_popularity')
+            .values_list('applied', flat=True).first())
+
+
+def in_off_peak_window(hour, start_hour, end_hour):
+    if start_hour <= end_hour:
+        return start_hour <= hour < end_hour
+    return hour >= start_hour or hour < end_hour
+
+
+def cpu_seconds_used():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def rendition_bytes():
+    """Size of all converted files, counting shared files once"""
+    total = 0
+    names = (Music.objects.filter(conversion_status='success')
+             .exclude(converted_file='').exclude(converted_file__isnull=True)
+             .values_list('converted_file', flat=True).distinct())
+    for name in names:
+        if default_storage.exists(name):
+            total += default_storage.size(name)
+    return total
+
+
+class Command(BaseCommand):
+    help = 'Pre-convert popular tracks and evict renditions nobody downloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Run outside the off-peak window')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be done')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        start_hour, end_hour = config['off_peak_hours']
+        hour = timezone.localtime().hour
+        if not options['force'] and not in_off_peak_window(hour, start_hour, end_hour):
+            self.stdout.write(f'Outside off-peak hours ({start_hour}:00-{end_hour}:00); use --force to run anyway')
+            return
+
+        # Make sure this process's buffered counts are included
+        flush()
+        cutoff = timezone.now() - timedelta(days=config['cold_days'])
+        evicted = self.evict_cold(config, cutoff, options['dry_run'])
+        self.warm(config, cutoff, evicted, options['dry_run'])
+
+    def evict_cold(self, config, cutoff, dry_run):
+        """Evict renditions not downloaded since cutoff and return their ids"""
+        is_cold = Q(popularity__last_accessed_at__lt=cutoff)
+        started = tracking_started(config)
+        if started is not None and started < cutoff:
+            # No downloads recorded in cold_days of tracking
+            is_cold |= Q(popularity__isnull=True, converted_at__lt=cutoff)
+        cold = (
+            Music.objects.filter(conversion_status='success')
+            .exclude(converted_file='').exclude(converted_file__isnull=True)
+            .filter(is_cold)
+        )
+        evicted = []
+        for music in cold:
+            self.stdout.write(f'Evicting {music.target_extension} rendition of {music}')
+            if not dry_run:
+                music.evict_conversion()
+            evicted.append(music.pk)
+        self.stdout.write(f'Evicted {len(evicted)} cold renditions')
+        return evicted
+
+    def warm(self, config, cutoff, evicted, dry_run):
+        # Failed conversions are left for the retry machinery, not retried here.
+        # Cold tracks are skipped too, or every run would evict and rebuild them.
+        unconverted = (Music.objects.filter(conversion_status='pending', popularity__isnull=False)
+                       .exclude(popularity__last_accessed_at__lt=cutoff)
+                       .exclude(pk__in=evicted)
+                       .select_related('popularity'))
+        hot = unconverted.order_by(F('popularity__hot_score').desc(nulls_last=True))[:config['candidates']]
+        trending = unconverted.order_by(F('popularity__trend_score').desc(nulls_last=True))[:config['candidates']]
+        # Interleave trending and hot so both get a share of the budget
+        candidates = []
+        for pair in zip_longest(trending, hot):
+            for music in pair:
+                if music is not None and music not in candidates:
+                    candidates.append(music)
+
+        cpu_start = cpu_seconds_used()
+        storage = rendition_bytes()
+        warmed = 0
+        for music in candidates:
+            if cpu_seconds_used() - cpu_start >= config['cpu_seconds']:
+                self.stdout.write('CPU budget used up')
+                break
+            if storage >= config['max_storage_bytes']:
+                self.stdout.write('Storage budget used up')
+                break
+            self.stdout.write(f'Warming {music.target_extension} rendition of {music}')
+            if dry_run:
+                continue
+            if music.convert_audio_file():
+                warmed += 1
+                storage += music.converted_file.size
+            else:
+                self.stdout.write(self.style.WARNING(f'Could not convert {music}: {music.error_message}'))
+        self.stdout.write(f'Warmed {warmed} renditions ({storage} bytes of renditions stored)')
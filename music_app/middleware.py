@@ -1,3 +1,40 @@
+import time
+import random
+import logging
+import threading
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.urls import resolve, Resolver404
+
+from .admission import admit, get_config as get_admission_config, release
+from .storage import StorageIO, storage_io
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Requests slower than this are logged with their cost breakdown
+    'slow_request_ms': 1000,
+    # Share of requests traced with tracemalloc
+    'memory_sample_rate': 0.01,
+    # Who gets the Server-Timing header besides everyone when DEBUG is on:
+    # staff users, and requests carrying one of these request.META keys
+    # with the given value (e.g. a secret set by a profiling proxy)
+    'server_timing_staff': True,
+    'server_timing_headers': {},
+}
+
+
+def get_config():
+    """Request accounting settings merged over the module defaults"""
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_ACCOUNTING', {})}
+
+
 class MobileUploadMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -11,4 +48,147 @@ class MobileUploadMiddleware:
         request.is_mobile_device = is_mobile
         
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+
+class UploadAdmissionMiddleware:
+    """Refuse uploads up front when the server cannot take them"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_admission_config()
+        if not config['enabled'] or request.method != 'POST':
+            return self.get_response(request)
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return self.get_response(request)
+        if url_name not in config['url_names']:
+            return self.get_response(request)
+
+        # Runs before anything reads request.body, so a refused upload costs
+        # nothing beyond the headers.
+        rejection, keys = admit(request, url_name)
+        if rejection:
+            if url_name == 'iphone_upload_api':
+                response = JsonResponse({'error': rejection.reason}, status=rejection.status)
+            else:
+                response = HttpResponse(rejection.reason, status=rejection.status, content_type='text/plain')
+            response['Retry-After'] = str(rejection.retry_after)
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            for key in keys:
+                release(key)
+
+
+
+class QueryStats:
+    """Database execute wrapper counting queries and the time spent in them"""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f'{size:.0f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GB'
+
+
+class ResourceAccountingMiddleware:
+    """
+    Measure what each request costs: wall and CPU time, database queries,
+    storage bytes and, for a sample of requests, peak Python memory growth.
+    The figures go out in a Server-Timing header to clients allowed to see
+    them, and requests slower than the configured threshold are logged
+    with the breakdown.
+    """
+    _tracing_lock = threading.Lock()
+    _tracing_requests = 0
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _start_tracing(self):
+        cls = type(self)
+        with cls._tracing_lock:
+            if cls._tracing_requests == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            cls._tracing_requests += 1
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        return baseline
+
+    def _may_see_timings(self, request, config):
+        """Whether the response may carry the Server-Timing breakdown"""
+        if settings.DEBUG:
+            return True
+        for key, value in config['server_timing_headers'].items():
+            if constant_time_compare(request.META.get(key, ''), value):
+                return True
+        # Set by AuthenticationMiddleware further down the chain
+        user = getattr(request, 'user', None)
+        return config['server_timing_staff'] and user is not None and user.is_staff
+
+    def _stop_tracing(self, baseline):
+        """Peak traced memory above baseline; concurrent sampled requests share the peak"""
+        cls = type(self)
+        with cls._tracing_lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            cls._tracing_requests -= 1
+            if cls._tracing_requests == 0:
+                tracemalloc.stop()
+        return max(0, peak - baseline)
+
+    def __call__(self, request):
+        config = get_config()
+        sampled = random.random() < config['memory_sample_rate']
+        queries = QueryStats()
+        io = StorageIO()
+        io_token = storage_io.set(io)
+        baseline = self._start_tracing() if sampled else None
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            wall = (time.perf_counter() - started) * 1000
+            cpu = (time.thread_time() - cpu_started) * 1000
+            memory = self._stop_tracing(baseline) if sampled else None
+            storage_io.reset(io_token)
+
+        if self._may_see_timings(request, config):
+            timings = [
+                f'total;dur={wall:.1f}',
+                f'cpu;dur={cpu:.1f}',
+                f'db;dur={queries.duration * 1000:.1f};desc="{queries.count} queries"',
+                f'storage;desc="read {_format_bytes(io.read)} written {_format_bytes(io.written)}"',
+            ]
+            if memory is not None:
+                timings.append(f'mem;desc="peak +{_format_bytes(memory)}"')
+            response['Server-Timing'] = ', '.join(timings)
+
+        if wall >= config['slow_request_ms']:
+            logger.warning(
+                f"Slow request {request.method} {request.path}: {wall:.0f}ms wall, {cpu:.0f}ms CPU, "
+                f"{queries.count} queries in {queries.duration * 1000:.0f}ms, "
+                f"storage read {_format_bytes(io.read)} written {_format_bytes(io.written)}, "
+                f"request body {_format_bytes(int(request.META.get('CONTENT_LENGTH') or 0))}"
+                + (f", peak memory +{_format_bytes(memory)}" if memory is not None else "")
+            )
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frame_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('music', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='music_app.music')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FingerprintHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.IntegerField(db_index=True)),
+                ('offset', models.PositiveIntegerField()),
+                ('fingerprint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashes', to='music_app.audiofingerprint')),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# The DDL is spelled out here rather than imported from music_app.search, so
+# later changes to the live index definition can't alter this migration.
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE music_app_music_fts USING fts5("
+    "title, artist, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "INSERT INTO music_app_music_fts (rowid, title, artist) "
+    "SELECT id, title, artist FROM music_app_music",
+]
+SQLITE_BACKWARDS = ["DROP TABLE IF EXISTS music_app_music_fts"]
+
+POSTGRESQL_FORWARDS = [
+    "CREATE INDEX music_app_music_search_idx ON music_app_music USING GIN "
+    "(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(artist, '')))",
+]
+POSTGRESQL_BACKWARDS = ["DROP INDEX IF EXISTS music_app_music_search_idx"]
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRESQL_FORWARDS}.get(vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRESQL_BACKWARDS}.get(vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0002_audio_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
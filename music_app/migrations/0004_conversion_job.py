@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0003_music_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority_class', models.CharField(choices=[('interactive', 'Interactive'), ('api', 'API'), ('bulk', 'Bulk')], default='bulk', max_length=20)),
+                ('client', models.CharField(blank=True, max_length=100)),
+                ('size', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('enqueued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversion_jobs', to='music_app.music')),
+            ],
+            options={
+                'ordering': ['enqueued_at'],
+                'indexes': [models.Index(fields=['status', 'priority_class', 'size'], name='music_app_c_status_0aa2bb_idx'), models.Index(fields=['status', 'priority_class', 'enqueued_at'], name='music_app_c_status_eb1c4e_idx')],
+            },
+        ),
+    ]
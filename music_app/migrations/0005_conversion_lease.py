@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0004_conversion_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_extension', models.CharField(max_length=10)),
+                ('settings_key', models.CharField(max_length=64)),
+                ('holder', models.CharField(max_length=64, unique=True)),
+                ('acquired_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversion_leases', to='music_app.music')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='conversionlease',
+            constraint=models.UniqueConstraint(fields=('music', 'target_extension', 'settings_key'), name='unique_conversion_lease'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0005_conversion_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ConversionAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.PositiveIntegerField()),
+                ('source_extension', models.CharField(max_length=10)),
+                ('target_extension', models.CharField(max_length=10)),
+                ('outcome', models.CharField(choices=[('success', 'Success'), ('transient', 'Transient error'), ('corrupt_input', 'Corrupt input'), ('unsupported_codec', 'Unsupported codec'), ('unknown', 'Unknown error')], max_length=20)),
+                ('error_message', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('duration', models.FloatField(default=0)),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversion_attempts', to='music_app.music')),
+            ],
+            options={
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['source_extension', 'target_extension'], name='music_app_c_source__38a239_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0006_conversion_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('original_downloads', models.PositiveIntegerField(default=0)),
+                ('hot_score', models.FloatField(blank=True, db_index=True, null=True)),
+                ('trend_score', models.FloatField(blank=True, db_index=True, null=True)),
+                ('last_accessed_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('music', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='popularity', to='music_app.music')),
+            ],
+            options={
+                'verbose_name_plural': 'Track popularity',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0007_track_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='music',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0008_music_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversionjob',
+            name='target_extension',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+    ]
@@ -1,9 +1,33 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError, connection
 import os
+import random
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
 from django.utils import timezone
 from django.core.files import File
 from io import BytesIO
-from .converters import convert_audio
+from .converters import convert_audio, conversion_settings_key, ConversionError
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def get_retry_config():
+    """Conversion retry settings merged over the defaults"""
+    config = {
+        'max_attempts': 3,
+        'base_delay': 1.0,  # seconds before the first retry, doubled each time
+        'max_delay': 30.0,
+        'retry_kinds': [ConversionError.TRANSIENT],
+        **getattr(settings, 'CONVERSION_RETRY', {}),
+    }
+    # Every conversion gets at least one attempt
+    config['max_attempts'] = max(1, int(config['max_attempts']))
+    return config
 
 class Music(models.Model):
     AUDIO_EXTENSIONS = [
@@ -30,6 +54,8 @@ class Music(models.Model):
         ('failed', 'Failed')
     ])
     error_message = models.TextField(blank=True)
+    # Incremented on every save; keys this row's cached fragments
+    version = models.PositiveBigIntegerField(default=0, editable=False)
     
     def __str__(self):
         return f"{self.title} - {self.artist}" if self.artist else self.title
@@ -43,46 +69,350 @@ class Music(models.Model):
             self.original_name = self.original_file.name
             name, ext = os.path.splitext(self.original_file.name)
             self.original_extension = ext[1:].lower() if ext else 'unknown'
+        
+        # Every save bumps the version in the database, so stale rendered
+        # fragments are never reused and concurrent saves can't collide
+        adding = self._state.adding
+        self.version = 1 if adding else models.F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
             
         super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=['version'])
+    
+    def converted_file_is_shared(self):
+        """True if another track reuses this track's converted file"""
+        return bool(self.converted_file) and Music.objects.filter(
+            converted_file=self.converted_file.name
+        ).exclude(pk=self.pk).exists()
+    
+    def reuse_conversion_from(self, other):
+        """Point this track at another track's converted file instead of converting"""
+        if not other.converted_file or other.target_extension != self.target_extension:
+            return False
+        self.converted_file = other.converted_file.name
+        self.converted_at = timezone.now()
+        self.conversion_status = 'success'
+        self.error_message = ''
+        self.save(update_fields=['converted_file', 'converted_at',
+                                 'conversion_status', 'error_message'])
+        return True
+    
+    def evict_conversion(self):
+        """Drop the converted file to free storage; it can be reconverted later"""
+        if self.converted_file and not self.converted_file_is_shared():
+            self.converted_file.delete(save=False)
+        self.converted_file = None
+        self.converted_at = None
+        self.conversion_status = 'pending'
+        self.error_message = ''
+        self.save(update_fields=['converted_file', 'converted_at',
+                                 'conversion_status', 'error_message'])
+    
+    def set_conversion_status(self, status, error_message=''):
+        """Record a conversion outcome, writing only the status columns"""
+        self.conversion_status = status
+        self.error_message = error_message
+        self.save(update_fields=['conversion_status', 'error_message'])
     
     def convert_audio_file(self):
-        """Convert the audio file to the target format using MoviePy"""
+        """
+        Convert the audio file to the target format.
+        
+        Only one conversion of a track to a given format and encoder setting
+        runs at a time. A duplicate request waits for the running one and
+        returns its outcome instead of starting a second conversion.
+        """
+        output_format = self.target_extension
+        input_path = self.original_file.path if self.original_file else ''
+        settings_key = conversion_settings_key(output_format, input_path)
+        token = ConversionLease.acquire(self, output_format, settings_key)
+        while token is None:
+            if ConversionLease.wait(self, output_format, settings_key):
+                self.refresh_from_db()
+                return (self.conversion_status == 'success' and bool(self.converted_file)
+                        and self.target_extension == output_format)
+            # The holder's lease expired without finishing; take over
+            token = ConversionLease.acquire(self, output_format, settings_key)
         try:
-            if self.original_file and self.target_extension:
+            with ConversionLease.keep_alive(token):
+                return self._convert(output_format, token)
+        finally:
+            ConversionLease.release(token)
+    
+    def _convert(self, output_format, lease_token=None):
+        """
+        Run the conversion and record its outcome.
+        
+        Transient failures (resources exhausted, FFmpeg killed) are retried
+        with exponential backoff up to the configured attempt budget; corrupt
+        input and unsupported codecs fail straight away. Every attempt is
+        recorded as a ConversionAttempt.
+        """
+        if not (self.original_file and output_format):
+            self.set_conversion_status('failed', 'Conversion failed: Missing original file or target format')
+            return False
+        
+        config = get_retry_config()
+        for attempt in range(1, config['max_attempts'] + 1):
+            started_at = timezone.now()
+            started = time.monotonic()
+            try:
                 # Convert the audio
-                output_format = self.target_extension
                 converted_data = convert_audio(self.original_file.path, output_format)
+                if not converted_data:
+                    raise ConversionError('No data returned')
                 
-                if converted_data:
-                    # Generate filename for converted file
-                    original_name = os.path.splitext(self.original_name)[0]
-                    converted_filename = f"{original_name}.{output_format}"
-                    
-                    # Save converted file
-                    self.converted_file.save(converted_filename, File(converted_data))
-                    self.converted_at = timezone.now()
-                    self.conversion_status = 'success'
-                    self.error_message = ''
-                    self.save()
-                    return True
-                else:
-                    self.conversion_status = 'failed'
-                    self.error_message = 'Conversion failed: No data returned'
-                    self.save()
-                    return False
-            else:
-                self.conversion_status = 'failed'
-                self.error_message = 'Conversion failed: Missing original file or target format'
-                self.save()
-                return False
+                # Generate filename for converted file
+                original_name = os.path.splitext(self.original_name)[0]
+                converted_filename = f"{original_name}.{output_format}"
                 
-        except Exception as e:
-            self.conversion_status = 'failed'
-            self.error_message = f'Conversion error: {str(e)}'
-            self.save()
-            return False
+                # Save converted file
+                self.converted_file.save(converted_filename, File(converted_data), save=False)
+            except Exception as e:
+                if not isinstance(e, ConversionError):
+                    kind = ConversionError.TRANSIENT if isinstance(e, (OSError, MemoryError)) else ConversionError.UNKNOWN
+                    e = ConversionError(str(e), kind)
+                self._record_attempt(attempt, output_format, e.kind, str(e), started_at, started)
+                if e.kind in config['retry_kinds'] and attempt < config['max_attempts']:
+                    delay = min(config['max_delay'], config['base_delay'] * 2 ** (attempt - 1))
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+                    if lease_token:
+                        ConversionLease.renew(lease_token)
+                    continue
+                self.set_conversion_status('failed', f'Conversion failed ({e.kind}, attempt {attempt}): {e}')
+                return False
+            
+            self._record_attempt(attempt, output_format, 'success', '', started_at, started)
+            self.converted_at = timezone.now()
+            self.conversion_status = 'success'
+            self.error_message = ''
+            self.save(update_fields=['converted_file', 'converted_at',
+                                     'conversion_status', 'error_message'])
+            return True
+    
+    def _record_attempt(self, attempt, output_format, outcome, error_message, started_at, started):
+        ConversionAttempt.objects.create(
+            music=self,
+            attempt=attempt,
+            source_extension=self.original_extension,
+            target_extension=output_format,
+            outcome=outcome,
+            error_message=error_message,
+            started_at=started_at,
+            duration=time.monotonic() - started,
+        )
     
     class Meta:
         verbose_name_plural = "Music Files"
-        ordering = ['-uploaded_at']
\ No newline at end of file
+        ordering = ['-uploaded_at']
+
+class AudioFingerprint(models.Model):
+    """Spectral fingerprint of the start of a track, used to spot re-encoded duplicates"""
+    music = models.OneToOneField(Music, on_delete=models.CASCADE, related_name='fingerprint')
+    frame_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Fingerprint of {self.music}"
+
+
+class FingerprintHash(models.Model):
+    """Index key derived from a sub-fingerprint, with its frame offset in the fingerprint"""
+    fingerprint = models.ForeignKey(AudioFingerprint, on_delete=models.CASCADE, related_name='hashes')
+    value = models.IntegerField(db_index=True)
+    offset = models.PositiveIntegerField()
+
+
+class ConversionJob(models.Model):
+    """Queued conversion of a track, picked up by the conversion worker"""
+    PRIORITY_CLASSES = [
+        ('interactive', 'Interactive'),
+        ('api', 'API'),
+        ('bulk', 'Bulk'),
+    ]
+    
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='conversion_jobs')
+    priority_class = models.CharField(max_length=20, choices=PRIORITY_CLASSES, default='bulk')
+    client = models.CharField(max_length=100, blank=True)
+    # Format the track was set to convert to when the job was queued
+    target_extension = models.CharField(max_length=10, blank=True)
+    size = models.BigIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, default='queued', choices=[
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ])
+    enqueued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.get_priority_class_display()} conversion of {self.music}"
+    
+    class Meta:
+        ordering = ['enqueued_at']
+        indexes = [
+            models.Index(fields=['status', 'priority_class', 'size']),
+            models.Index(fields=['status', 'priority_class', 'enqueued_at']),
+        ]
+
+
+
+class ConversionLease(models.Model):
+    """
+    Claim on converting one track to one format with one set of encoder
+    settings. Expires so a crashed worker cannot block conversions forever.
+    """
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='conversion_leases')
+    target_extension = models.CharField(max_length=10)
+    settings_key = models.CharField(max_length=64)
+    holder = models.CharField(max_length=64, unique=True)
+    acquired_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['music', 'target_extension', 'settings_key'],
+                                    name='unique_conversion_lease'),
+        ]
+    
+    @staticmethod
+    def get_config():
+        return {
+            'lease_seconds': 900,
+            'poll_interval': 0.5,
+            **getattr(settings, 'CONVERSION_LEASE', {}),
+        }
+    
+    @classmethod
+    def acquire(cls, music, target_extension, settings_key):
+        """Take the lease, or an expired one, returning a holder token or None"""
+        config = cls.get_config()
+        token = uuid.uuid4().hex
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=config['lease_seconds'])
+        try:
+            with transaction.atomic():
+                cls.objects.create(music=music, target_extension=target_extension,
+                                   settings_key=settings_key, holder=token,
+                                   acquired_at=now, expires_at=expires_at)
+            return token
+        except IntegrityError:
+            taken_over = cls.objects.filter(
+                music=music, target_extension=target_extension,
+                settings_key=settings_key, expires_at__lt=now,
+            ).update(holder=token, acquired_at=now, expires_at=expires_at)
+            return token if taken_over else None
+    
+    @classmethod
+    def renew(cls, token):
+        """Push back the expiry of a lease that is still in use"""
+        lease_seconds = cls.get_config()['lease_seconds']
+        cls.objects.filter(holder=token).update(expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+    
+    @classmethod
+    @contextmanager
+    def keep_alive(cls, token):
+        """
+        Renew the lease from a background thread for as long as the block
+        runs, so a single conversion longer than lease_seconds keeps it
+        """
+        interval = cls.get_config()['lease_seconds'] / 3
+        stopped = threading.Event()
+        
+        def heartbeat():
+            try:
+                while not stopped.wait(interval):
+                    try:
+                        cls.renew(token)
+                    except Exception as e:
+                        logger.warning(f"Could not renew conversion lease {token}: {e}")
+            finally:
+                connection.close()
+        
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+    
+    @classmethod
+    def release(cls, token):
+        cls.objects.filter(holder=token).delete()
+    
+    @classmethod
+    def wait(cls, music, target_extension, settings_key):
+        """
+        Block until the current lease is released (True) or expires (False)
+        """
+        config = cls.get_config()
+        while True:
+            lease = cls.objects.filter(music=music, target_extension=target_extension,
+                                       settings_key=settings_key).first()
+            if lease is None:
+                return True
+            if lease.expires_at < timezone.now():
+                return False
+            time.sleep(config['poll_interval'])
+
+
+
+class ConversionAttempt(models.Model):
+    """One try at converting a track, kept to measure failure and retry rates"""
+    OUTCOMES = [
+        ('success', 'Success'),
+        (ConversionError.TRANSIENT, 'Transient error'),
+        (ConversionError.CORRUPT_INPUT, 'Corrupt input'),
+        (ConversionError.UNSUPPORTED_CODEC, 'Unsupported codec'),
+        (ConversionError.UNKNOWN, 'Unknown error'),
+    ]
+    
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='conversion_attempts')
+    attempt = models.PositiveIntegerField()
+    source_extension = models.CharField(max_length=10)
+    target_extension = models.CharField(max_length=10)
+    outcome = models.CharField(max_length=20, choices=OUTCOMES)
+    error_message = models.TextField(blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    duration = models.FloatField(default=0)
+    
+    def __str__(self):
+        return f"Attempt {self.attempt} for {self.music}: {self.outcome}"
+    
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['source_extension', 'target_extension']),
+        ]
+
+
+
+class TrackPopularity(models.Model):
+    """
+    Download counts and popularity scores for a track, updated in batches.
+    
+    Scores are exponentially decayed access counts stored as base-2
+    logarithms relative to a fixed epoch, so rows updated at different
+    times can be compared directly in SQL without rewriting every row.
+    hot_score decays slowly; trend_score decays quickly and picks out
+    tracks that are suddenly popular.
+    """
+    music = models.OneToOneField(Music, on_delete=models.CASCADE, related_name='popularity')
+    downloads = models.PositiveIntegerField(default=0)
+    original_downloads = models.PositiveIntegerField(default=0)
+    hot_score = models.FloatField(blank=True, null=True, db_index=True)
+    trend_score = models.FloatField(blank=True, null=True, db_index=True)
+    last_accessed_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    
+    def __str__(self):
+        return f"Popularity of {self.music}"
+    
+    class Meta:
+        verbose_name_plural = "Track popularity"
@@ -0,0 +1,94 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Count, Max, Sum
+from django.utils.safestring import mark_safe
+
+from .models import Music
+
+DEFAULTS = {
+    # Seconds a rendered row fragment stays cached
+    'timeout': 3600,
+}
+
+# Fragments cached per Music row, by the name used in their cache key
+FRAGMENTS = ('music_card', 'admin_audio_preview', 'admin_actions')
+
+
+def get_config():
+    """Render cache settings merged over the module defaults"""
+    return {**DEFAULTS, **getattr(settings, 'RENDER_CACHE', {})}
+
+
+def fragment_key(name, music):
+    """Cache key for a row fragment; matches {% cache ... name music.pk music.version %}"""
+    return make_template_fragment_key(name, [music.pk, music.version])
+
+
+def cached_fragment(name, music, render):
+    """Return the HTML render(music) produces, rendering only on a cache miss"""
+    key = fragment_key(name, music)
+    html = cache.get(key)
+    if html is None:
+        html = render(music)
+        cache.set(key, str(html), get_config()['timeout'])
+    return mark_safe(html)
+
+
+def forget(music):
+    """Drop a row's cached fragments"""
+    cache.delete_many([fragment_key(name, music) for name in FRAGMENTS])
+
+
+def list_state(request):
+    """Row count and latest change of the music table, one query per request"""
+    if not hasattr(request, '_music_list_state'):
+        request._music_list_state = Music.objects.aggregate(
+            count=Count('pk'),
+            last_pk=Max('pk'),
+            versions=Sum('version'),
+            uploaded_at=Max('uploaded_at'),
+            converted_at=Max('converted_at'),
+        )
+    return request._music_list_state
+
+
+def _has_pending_messages(request):
+    # A 304 would leave queued flash messages unshown
+    return bool(len(messages.get_messages(request)))
+
+
+def music_list_etag(request):
+    """
+    ETag for the music list page. Every save raises the sum of row versions,
+    every delete lowers the count and every insert takes a new highest pk,
+    all without relying on clocks. The search query and CSRF cookie are
+    included because the page renders them.
+    """
+    if _has_pending_messages(request):
+        return None
+    state = list_state(request)
+    parts = [
+        state['count'],
+        state['last_pk'],
+        state['versions'],
+        request.GET.get('q', '').strip(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def music_list_last_modified(request):
+    """
+    Latest upload or conversion of any track. Edits and deletes don't move
+    it, so clients sending If-None-Match get the ETag check, which Django
+    gives precedence over If-Modified-Since.
+    """
+    if _has_pending_messages(request):
+        return None
+    state = list_state(request)
+    times = [state['uploaded_at'], state['converted_at']]
+    return max((t for t in times if t is not None), default=None)
@@ -0,0 +1,234 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q, F, Exists, OuterRef
+from django.utils import timezone
+
+from .models import ConversionJob, ConversionAttempt, ConversionLease, AudioFingerprint, get_retry_config
+from .fingerprint import reuse_duplicate_conversion
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Convert inline (False) or queue interactive uploads for the worker (True)
+    'async_uploads': False,
+    # Higher level runs first
+    'class_levels': {'interactive': 3, 'api': 2, 'bulk': 1},
+    # Each full interval spent waiting raises a job one level
+    'aging_seconds': 300,
+    # Jobs started within this window count against their client's share
+    'fair_share_seconds': 600,
+    # Queued jobs per class considered when picking the next one
+    'window': 100,
+}
+
+
+def get_config():
+    """Scheduler settings merged over the module defaults"""
+    return {**DEFAULTS, **getattr(settings, 'CONVERSION_SCHEDULER', {})}
+
+
+def async_uploads_enabled():
+    return get_config()['async_uploads']
+
+
+def client_for_request(request):
+    """Identify who is asking, for fair sharing between clients"""
+    if getattr(request, 'user', None) is not None and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def enqueue(music, priority_class='bulk', client=''):
+    """
+    Queue a conversion of music; file size stands in for job length.
+    
+    If the track already has a job queued, or running for the same target,
+    that job is returned instead of adding a duplicate. A queued job is
+    raised to priority_class when that is higher. Queued jobs convert to
+    whatever the track's target is when they run, so any queued job will do.
+    """
+    existing = (
+        ConversionJob.objects
+        .filter(music=music)
+        .filter(Q(status='queued') | Q(status='running', target_extension=music.target_extension))
+        .order_by('enqueued_at')
+        .first()
+    )
+    if existing:
+        levels = get_config()['class_levels']
+        if existing.status == 'queued' and levels.get(priority_class, 0) > levels.get(existing.priority_class, 0):
+            existing.priority_class = priority_class
+            existing.client = client
+            existing.save(update_fields=['priority_class', 'client'])
+        return existing
+    
+    try:
+        size = music.original_file.size if music.original_file else 0
+    except OSError:
+        size = 0
+    return ConversionJob.objects.create(
+        music=music,
+        priority_class=priority_class,
+        client=client,
+        target_extension=music.target_extension,
+        size=size,
+    )
+
+
+def _candidates(config):
+    """Shortest and oldest queued jobs of each class"""
+    jobs = {}
+    queued = ConversionJob.objects.filter(status='queued')
+    for priority_class in config['class_levels']:
+        in_class = queued.filter(priority_class=priority_class)
+        for ordering in (('size', 'enqueued_at'), ('enqueued_at',)):
+            for job in in_class.order_by(*ordering)[:config['window']]:
+                jobs[job.pk] = job
+    return list(jobs.values())
+
+
+def _client_usage(config, now):
+    """Jobs each client has running or started recently"""
+    since = now - timedelta(seconds=config['fair_share_seconds'])
+    return Counter(
+        ConversionJob.objects
+        .filter(started_at__gte=since)
+        .values_list('client', flat=True)
+    ) + Counter(
+        ConversionJob.objects
+        .filter(status='running', started_at__lt=since)
+        .values_list('client', flat=True)
+    )
+
+
+def order_jobs(jobs, usage, now, config=None):
+    """
+    Sort jobs into the order they should run.
+
+    Jobs are ranked by their class level, raised one level per aging
+    interval spent waiting so bulk work is never starved. Within a level
+    the client that has used the fewest recent slots goes first, then the
+    smallest file (shortest job first), then the oldest.
+    """
+    config = config or get_config()
+    levels = config['class_levels']
+    top = max(levels.values())
+
+    def key(job):
+        waited = (now - job.enqueued_at).total_seconds()
+        level = min(top, levels.get(job.priority_class, 0) + int(waited // config['aging_seconds']))
+        return (-level, usage.get(job.client, 0), job.size, job.enqueued_at)
+
+    return sorted(jobs, key=key)
+
+
+def claim_next_job():
+    """Atomically mark the best queued job as running and return it"""
+    config = get_config()
+    now = timezone.now()
+    for job in order_jobs(_candidates(config), _client_usage(config, now), now, config):
+        claimed = ConversionJob.objects.filter(pk=job.pk, status='queued').update(
+            status='running', started_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            job.status = 'running'
+            job.started_at = now
+            job.attempts += 1
+            return job
+    return None
+
+
+def requeue_stale_jobs():
+    """
+    Put back jobs whose worker died mid-conversion, or fail them once they
+    have used up their attempt budget. A running job is stale once no live
+    conversion lease covers its track and format; a live worker keeps its
+    lease renewed. Jobs get one lease length after starting to take it.
+    """
+    now = timezone.now()
+    live_lease = ConversionLease.objects.filter(
+        music=OuterRef('music'),
+        target_extension=OuterRef('music__target_extension'),
+        expires_at__gte=now,
+    )
+    stale = ConversionJob.objects.filter(
+        status='running',
+        started_at__lt=now - timedelta(seconds=ConversionLease.get_config()['lease_seconds']),
+    ).exclude(Exists(live_lease))
+    max_attempts = get_retry_config()['max_attempts']
+    failed = stale.filter(attempts__gte=max_attempts).update(status='failed', finished_at=now)
+    requeued = stale.filter(attempts__lt=max_attempts).update(status='queued', started_at=None)
+    if failed or requeued:
+        logger.warning(f"Requeued {requeued} and failed {failed} stale conversion jobs")
+    return requeued, failed
+
+
+def run_job(job):
+    """Convert the job's track and record the outcome"""
+    music = job.music
+    try:
+        if AudioFingerprint.objects.filter(music=music).exists():
+            success = music.convert_audio_file()
+        else:
+            # Queued uploads skip fingerprinting in the request; do it here, so
+            # a duplicate of an already converted track reuses that conversion
+            success = reuse_duplicate_conversion(music) or music.convert_audio_file()
+    except Exception as e:
+        logger.error(f"Conversion job {job.pk} crashed: {e}")
+        success = False
+    job.status = 'done' if success else 'failed'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    return success
+
+
+def queue_stats(since_seconds=3600):
+    """Queue depth and wait times per priority class"""
+    now = timezone.now()
+    since = now - timedelta(seconds=since_seconds)
+    stats = {}
+    for priority_class, label in ConversionJob.PRIORITY_CLASSES:
+        jobs = ConversionJob.objects.filter(priority_class=priority_class)
+        queued_waits = [
+            (now - enqueued_at).total_seconds()
+            for enqueued_at in jobs.filter(status='queued').values_list('enqueued_at', flat=True)
+        ]
+        started_waits = [
+            (started_at - enqueued_at).total_seconds()
+            for enqueued_at, started_at in jobs.filter(started_at__gte=since)
+            .values_list('enqueued_at', 'started_at')
+        ]
+        stats[priority_class] = {
+            'queued': len(queued_waits),
+            'running': jobs.filter(status='running').count(),
+            'oldest_wait': max(queued_waits, default=0),
+            'avg_wait': sum(started_waits) / len(started_waits) if started_waits else 0,
+            'max_wait': max(started_waits, default=0),
+            'started': len(started_waits),
+        }
+    return stats
+
+
+def retry_stats(since_seconds=7 * 24 * 3600):
+    """Attempts, retries and failures per source/target format pair"""
+    since = timezone.now() - timedelta(seconds=since_seconds)
+    rows = list(
+        ConversionAttempt.objects
+        .filter(started_at__gte=since)
+        .values('source_extension', 'target_extension')
+        .annotate(
+            attempts=Count('id'),
+            retries=Count('id', filter=Q(attempt__gt=1)),
+            successes=Count('id', filter=Q(outcome='success')),
+            transient=Count('id', filter=Q(outcome='transient')),
+        )
+        .order_by('source_extension', 'target_extension')
+    )
+    for row in rows:
+        conversions = row['attempts'] - row['retries']
+        row['retry_rate'] = row['retries'] / conversions if conversions else 0
+    return rows
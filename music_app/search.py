@@ -0,0 +1,120 @@
+import re
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.db.models.expressions import RawSQL
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Created by migration 0003; PG_DOCUMENT must match the indexed expression
+FTS_TABLE = 'music_app_music_fts'
+PG_DOCUMENT = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(artist, ''))"
+
+
+def get_max_results():
+    return getattr(settings, 'MUSIC_SEARCH', {}).get('max_results', 200)
+
+
+def tokenize(query):
+    """Split a search string into lowercase word tokens"""
+    return re.findall(r'\w+', query.lower())
+
+
+def _fts_match(tokens):
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _pg_tsquery(tokens):
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def index_music(music):
+    """Add or refresh a track in the SQLite index (PostgreSQL indexes itself)"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [music.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, artist) VALUES (%s, %s, %s)",
+            [music.pk, music.title, music.artist],
+        )
+
+
+def unindex_music(pk):
+    """Remove a track from the SQLite index"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [pk])
+
+
+def matching_ids(query):
+    """
+    Return ids of tracks matching every word of query as a prefix, best
+    ranked first, or None if the database has no full-text index.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    limit = get_max_results()
+    if connection.vendor == 'sqlite':
+        sql = (
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, 2.0, 1.0) LIMIT %s"
+        )
+        params = [_fts_match(tokens), limit]
+    elif connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT id FROM music_app_music WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s)) DESC LIMIT %s"
+        )
+        tsquery = _pg_tsquery(tokens)
+        params = [tsquery, tsquery, limit]
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _substring_filter(queryset, tokens):
+    # No full-text index on this database; fall back to substring scans
+    condition = Q()
+    for token in tokens:
+        condition &= Q(title__icontains=token) | Q(artist__icontains=token)
+    return queryset.filter(condition)
+
+
+def search_music(queryset, query):
+    """Filter a Music queryset to rows matching query, best matches first"""
+    ids = matching_ids(query)
+    if ids is None:
+        return _substring_filter(queryset, tokenize(query))
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(rank)
+
+
+def filter_music(queryset, query):
+    """
+    Filter a Music queryset to every row matching query, through the
+    full-text index but without ranking or the max_results cap. For
+    callers that impose their own ordering, like the admin changelist.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none()
+    if connection.vendor == 'sqlite':
+        ids = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [_fts_match(tokens)])
+    elif connection.vendor == 'postgresql':
+        ids = RawSQL(
+            f"SELECT id FROM music_app_music WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s)",
+            [_pg_tsquery(tokens)],
+        )
+    else:
+        return _substring_filter(queryset, tokens)
+    return queryset.filter(pk__in=ids)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Music
+from .search import index_music, unindex_music
+from .render_cache import forget
+
+
+def apply_sqlite_pragmas(cursor, pragmas):
+    """Run a PRAGMA statement for each name/value pair on a SQLite cursor"""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Tune every new SQLite connection for concurrent readers and writers"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            apply_sqlite_pragmas(cursor, pragmas)
+
+
+@receiver(post_save, sender=Music)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    """Keep the full-text index in step with title and artist edits"""
+    if update_fields is not None and not {'title', 'artist'} & set(update_fields):
+        return
+    index_music(instance)
+
+
+@receiver(post_delete, sender=Music)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_music(instance.pk)
+
+
+@receiver(post_delete, sender=Music)
+def forget_rendered_fragments(sender, instance, **kwargs):
+    # Saves need nothing here: a new version means new fragment keys
+    forget(instance)
@@ -0,0 +1,35 @@
+from contextvars import ContextVar
+
+from django.core.files.storage import FileSystemStorage
+
+# Byte counters for the request being handled, set by ResourceAccountingMiddleware
+storage_io = ContextVar('storage_io', default=None)
+
+
+class StorageIO:
+    """Bytes read from and written to storage during one request"""
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+
+
+def record_storage_io(read=0, written=0):
+    counters = storage_io.get()
+    if counters is not None:
+        counters.read += read
+        counters.written += written
+
+
+class InstrumentedFileSystemStorage(FileSystemStorage):
+    """FileSystemStorage that reports bytes stored and opened to the current request"""
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        record_storage_io(written=content.size)
+        return name
+
+    def _open(self, name, mode='rb'):
+        file = super()._open(name, mode)
+        if 'r' in mode:
+            # Files are streamed whole to the client, so count the full size
+            record_storage_io(read=file.size)
+        return file
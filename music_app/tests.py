@@ -1,3 +1,588 @@
-from django.test import TestCase
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from io import StringIO
+import wave
+from unittest import mock
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .fingerprint import fingerprint_music, find_duplicate
+from .converters import (conversion_settings_key, conversion_method, classify_failure, ConversionError,
+                         can_convert_in_process, convert_audio)
+from .models import Music, ConversionJob, ConversionLease, ConversionAttempt, TrackPopularity
+from .access import record_access, flush as flush_access
+from .scheduler import enqueue, order_jobs, claim_next_job, queue_stats, requeue_stale_jobs, retry_stats, run_job
+from .search import search_music, filter_music
+from .admission import release
+from .management.commands.warm_renditions import in_off_peak_window
+
+
+def _use_database_file(db_path):
+    """Point this forked process's default connection at a SQLite file"""
+    settings_dict = {**connections['default'].settings_dict, 'NAME': db_path}
+    connections['default'] = type(connections['default'])(settings_dict, 'default')
+
+
+def _create_hammer_database(db_path, rows):
+    _use_database_file(db_path)
+    call_command('migrate', verbosity=0)
+    for i in range(rows):
+        Music.objects.create(title=f'Song {i}', original_file=f'music/original/{i}.mp3')
+
+
+def _hammer_status_updates(db_path, worker, rounds):
+    """Flip conversion_status on every row repeatedly from a separate process"""
+    _use_database_file(db_path)
+    tracks = list(Music.objects.order_by('pk'))
+    statuses = ('pending', 'success', 'failed')
+    for i in range(rounds):
+        music = tracks[i % len(tracks)]
+        music.set_conversion_status(statuses[(worker + i) % 3], f'worker {worker}')
+        Music.objects.filter(conversion_status='failed').count()
+
+
+@unittest.skipUnless(settings.DATABASES['default']['ENGINE'].endswith('sqlite3'), 'SQLite only')
+class SQLiteConcurrencyTests(TestCase):
+    def test_connection_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA foreign_keys')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'requires fork')
+    def test_concurrent_status_updates_do_not_lock(self):
+        # Child processes use their own Django connections to a file database,
+        # so the pragmas, timeout and update_fields writes are all exercised
+        ctx = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, 'hammer.sqlite3')
+            setup = ctx.Process(target=_create_hammer_database, args=(db_path, 10))
+            setup.start()
+            setup.join(120)
+            self.assertEqual(setup.exitcode, 0)
+
+            workers = [ctx.Process(target=_hammer_status_updates, args=(db_path, n, 200)) for n in range(8)]
+            for process in workers:
+                process.start()
+            for process in workers:
+                process.join(60)
+            self.assertEqual([process.exitcode for process in workers], [0] * len(workers))
+
+            conn = sqlite3.connect(db_path)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM music_app_music WHERE error_message = ''").fetchone()[0], 0)
+            conn.close()
+
+
+def _write_wav(path, samples, rate=44100):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.clip(samples, -32768, 32767).astype('<i2').tobytes())
+
+
+def _song(seed, seconds=8, rate=44100):
+    """Random chords over filtered noise, broadband enough to fingerprint"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * 0.25)) / rate
+    notes = []
+    for _ in range(seconds * 4):
+        chord = sum(np.sin(2 * np.pi * freq * t + rng.uniform(0, 6)) for freq in rng.uniform(250, 2200, 12))
+        noise = np.convolve(rng.normal(0, 1, len(t)), np.ones(8) / 8, 'same') * 3
+        notes.append((chord + noise) * np.exp(-t * 4))
+    return np.concatenate(notes) * 2500
+
+
+class FingerprintTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media.name, 'music', 'original'))
+
+    def _music(self, name, samples, **kwargs):
+        _write_wav(os.path.join(self.media.name, 'music', 'original', name), samples)
+        return Music.objects.create(title=name, original_file=f'music/original/{name}', target_extension='mp3', **kwargs)
+
+    def test_reencoded_copy_matches_converted_track(self):
+        song = _song(1)
+        converted = self._music('a.wav', song, conversion_status='success', converted_file='music/converted/a.mp3')
+        fingerprint_music(converted)
+
+        # Shifted by a few milliseconds, quieter and noisy, like a re-encode
+        rng = np.random.default_rng(0)
+        copy = np.concatenate([np.zeros(90), song * 0.7]) + rng.normal(0, 100, len(song) + 90)
+        upload = self._music('b.wav', copy)
+        self.assertEqual(find_duplicate(fingerprint_music(upload)), converted)
+        self.assertTrue(upload.reuse_conversion_from(converted))
+        self.assertTrue(upload.converted_file_is_shared())
+
+    def test_different_track_does_not_match(self):
+        converted = self._music('a.wav', _song(1), conversion_status='success', converted_file='music/converted/a.mp3')
+        fingerprint_music(converted)
+        upload = self._music('c.wav', _song(2))
+        self.assertIsNone(find_duplicate(fingerprint_music(upload)))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.song = Music.objects.create(title='Bohemian Rhapsody', artist='Queen', original_file='music/original/a.mp3')
+        self.other = Music.objects.create(title='Queen of Hearts', artist='Juice Newton', original_file='music/original/b.mp3')
+
+    def search(self, query):
+        return list(search_music(Music.objects.all(), query))
+
+    def test_prefix_and_multi_word_matching(self):
+        self.assertEqual(self.search('bohem'), [self.song])
+        self.assertEqual(self.search('queen rhap'), [self.song])
+        self.assertCountEqual(self.search('que'), [self.song, self.other])
+        self.assertEqual(self.search('zeppelin'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.song.title = 'Killer Queen'
+        self.song.save()
+        self.assertEqual(self.search('killer'), [self.song])
+        self.assertEqual(self.search('bohemian'), [])
+        self.other.delete()
+        self.assertEqual(self.search('hearts'), [])
+
+    def test_music_list_search_parameter(self):
+        response = self.client.get('/', {'q': 'juice'})
+        self.assertEqual(list(response.context['music_files']), [self.other])
+
+    @override_settings(MUSIC_SEARCH={'max_results': 1})
+    def test_admin_search_is_not_capped(self):
+        self.assertEqual(len(self.search('queen')), 1)
+        self.assertCountEqual(filter_music(Music.objects.all(), 'queen'), [self.song, self.other])
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.music = Music.objects.create(title='Song', original_file='music/original/a.mp3')
+
+    def job(self, priority_class, client='ip:1', size=1000, waited=0):
+        return ConversionJob(music=self.music, priority_class=priority_class, client=client,
+                             size=size, enqueued_at=self.now - timedelta(seconds=waited))
+
+    def test_interactive_jumps_bulk_queue(self):
+        bulk = [self.job('bulk', size=10) for _ in range(5)]
+        interactive = self.job('interactive', size=10 ** 6)
+        self.assertIs(order_jobs(bulk + [interactive], {}, self.now)[0], interactive)
+
+    def test_shortest_job_first_within_class(self):
+        big, small = self.job('api', size=5000), self.job('api', size=50)
+        self.assertEqual(order_jobs([big, small], {}, self.now), [small, big])
+
+    def test_fair_share_between_clients(self):
+        heavy = self.job('bulk', client='ip:heavy', size=10)
+        light = self.job('bulk', client='ip:light', size=10 ** 6)
+        self.assertIs(order_jobs([heavy, light], {'ip:heavy': 20}, self.now)[0], light)
+
+    def test_aging_prevents_starvation(self):
+        old_bulk = self.job('bulk', waited=700)
+        api = self.job('api', size=1)
+        self.assertIs(order_jobs([api, old_bulk], {}, self.now)[0], old_bulk)
+
+    def test_claim_and_stats(self):
+        for job in (self.job('bulk'), self.job('interactive')):
+            job.save()
+        claimed = claim_next_job()
+        self.assertEqual(claimed.priority_class, 'interactive')
+        stats = queue_stats()
+        self.assertEqual(stats['interactive']['running'], 1)
+        self.assertEqual(stats['bulk']['queued'], 1)
+
+    def test_queued_upload_is_fingerprinted_by_the_worker(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with override_settings(MEDIA_ROOT=media.name, CONVERSION_SCHEDULER={'async_uploads': True}), \
+                mock.patch('music_app.views.reuse_duplicate_conversion') as in_request:
+            self.client.post('/api/iphone-upload/', b'data', content_type='audio/mpeg')
+        in_request.assert_not_called()
+        with mock.patch('music_app.scheduler.reuse_duplicate_conversion', return_value=True) as in_worker, \
+                mock.patch.object(Music, 'convert_audio_file') as convert:
+            self.assertTrue(run_job(claim_next_job()))
+        in_worker.assert_called_once()
+        convert.assert_not_called()
+
+    def test_enqueue_merges_with_pending_job(self):
+        first = enqueue(self.music, 'bulk')
+        self.assertEqual(enqueue(self.music, 'bulk'), first)
+        self.assertEqual(enqueue(self.music, 'interactive', 'ip:2'), first)
+        first.refresh_from_db()
+        self.assertEqual((first.priority_class, first.client), ('interactive', 'ip:2'))
+        first.status = 'running'
+        first.save()
+        self.assertEqual(enqueue(self.music, 'bulk'), first)
+        self.music.target_extension = 'ogg'
+        self.music.save()
+        self.assertNotEqual(enqueue(self.music, 'bulk'), first)
+        self.assertEqual(ConversionJob.objects.count(), 2)
+
+    def test_running_job_with_live_lease_is_not_stale(self):
+        started = self.now - timedelta(hours=1)
+        live = ConversionJob.objects.create(music=self.music, status='running', started_at=started, attempts=1)
+        other = Music.objects.create(title='Other', original_file='music/original/b.mp3')
+        dead = ConversionJob.objects.create(music=other, status='running', started_at=started, attempts=1)
+        ConversionLease.objects.create(music=self.music, target_extension=self.music.target_extension,
+                                       settings_key='k', holder='worker',
+                                       expires_at=self.now + timedelta(minutes=5))
+        self.assertEqual(requeue_stale_jobs(), (1, 0))
+        live.refresh_from_db()
+        dead.refresh_from_db()
+        self.assertEqual((live.status, dead.status), ('running', 'queued'))
+
+    def test_api_uploads_queue_only_when_async_uploads_are_enabled(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with override_settings(MEDIA_ROOT=media.name), \
+                mock.patch.object(Music, 'convert_audio_file', return_value=True) as convert:
+            self.client.post('/api/iphone-upload/', b'data', content_type='audio/mpeg')
+            self.assertFalse(ConversionJob.objects.exists())
+            convert.assert_called_once()
+            with override_settings(CONVERSION_SCHEDULER={'async_uploads': True}):
+                self.client.post('/api/iphone-upload/', b'data', content_type='audio/mpeg')
+            self.assertEqual(ConversionJob.objects.get().priority_class, 'api')
+            convert.assert_called_once()
+
+
+class UploadAdmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def post(self):
+        return self.client.post('/api/iphone-upload/', b'', content_type='audio/mpeg')
+
+    @override_settings(CONVERSION_SCHEDULER={'async_uploads': True})
+    def test_rejects_when_backlog_is_full(self):
+        music = Music.objects.create(title='Song', original_file='music/original/a.mp3')
+        ConversionJob.objects.bulk_create([ConversionJob(music=music, priority_class='api') for _ in range(3)])
+        with override_settings(UPLOAD_ADMISSION={'max_backlog': 2, 'default_job_seconds': 30}):
+            response = self.post()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_bulk_backlog_does_not_block_uploads(self):
+        music = Music.objects.create(title='Song', original_file='music/original/a.mp3')
+        ConversionJob.objects.bulk_create([ConversionJob(music=music, priority_class='bulk') for _ in range(200)])
+        with override_settings(CONVERSION_SCHEDULER={'async_uploads': True}):
+            response = self.client.post('/upload/', {'title': 'New'})
+        self.assertNotEqual(response.status_code, 503)
+        # Inline conversion ignores the queue entirely
+        ConversionJob.objects.update(priority_class='interactive')
+        response = self.client.post('/upload/', {'title': 'New'})
+        self.assertNotEqual(response.status_code, 503)
+
+    def test_rejects_when_disk_is_full(self):
+        with override_settings(UPLOAD_ADMISSION={'min_free_bytes': 2 ** 62}):
+            response = self.post()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    def test_per_client_concurrency_limit(self):
+        cache.set('upload_admission:in_flight:ip:127.0.0.1', 2)
+        self.assertEqual(self.post().status_code, 429)
+        cache.set('upload_admission:in_flight:ip:127.0.0.1', 1)
+        self.assertNotIn(self.post().status_code, (429, 503))
+        self.assertEqual(cache.get('upload_admission:in_flight:ip:127.0.0.1'), 1)
+
+    @override_settings(UPLOAD_ADMISSION={'client_ip_header': 'HTTP_X_FORWARDED_FOR'})
+    def test_clients_behind_a_proxy_are_counted_apart(self):
+        cache.set('upload_admission:in_flight:ip:10.0.0.1', 2)
+        response = self.client.post('/api/iphone-upload/', b'', content_type='audio/mpeg',
+                                    HTTP_X_FORWARDED_FOR='spoofed, 10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        response = self.client.post('/api/iphone-upload/', b'', content_type='audio/mpeg',
+                                    HTTP_X_FORWARDED_FOR='10.0.0.2')
+        self.assertNotIn(response.status_code, (429, 503))
+
+    def test_counters_stay_alive_and_never_go_negative(self):
+        key = 'upload_admission:in_flight:ip:127.0.0.1'
+        with override_settings(UPLOAD_ADMISSION={'counter_timeout': 60}), \
+                mock.patch.object(cache, 'touch', wraps=cache.touch) as touch:
+            self.post()
+        touch.assert_any_call(key, 60)
+        cache.set(key, 0)
+        release(key)
+        self.assertEqual(cache.get(key), 0)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.music = Music.objects.create(title='Song', original_file='music/original/a.mp3', target_extension='ogg')
+        self.key = conversion_settings_key('ogg', self.music.original_file.path)
+
+    def test_duplicate_request_shares_running_conversion(self):
+        token = ConversionLease.acquire(self.music, 'ogg', self.key)
+        self.assertIsNone(ConversionLease.acquire(self.music, 'ogg', self.key))
+
+        def finish_first_conversion(seconds):
+            Music.objects.filter(pk=self.music.pk).update(
+                conversion_status='success', converted_file='music/converted/a.ogg')
+            ConversionLease.release(token)
+
+        with mock.patch('music_app.models.time.sleep', side_effect=finish_first_conversion), \
+                mock.patch('music_app.models.convert_audio') as convert:
+            self.assertTrue(self.music.convert_audio_file())
+        convert.assert_not_called()
+        self.assertFalse(ConversionLease.objects.exists())
+
+    @override_settings(CONVERSION_LEASE={'lease_seconds': 0.03})
+    def test_lease_is_renewed_during_a_long_conversion(self):
+        def slow_convert(path, output_format):
+            time.sleep(0.1)
+            raise ConversionError('bad file', ConversionError.CORRUPT_INPUT)
+
+        with mock.patch('music_app.models.convert_audio', side_effect=slow_convert), \
+                mock.patch.object(ConversionLease, 'renew') as renew:
+            self.music.convert_audio_file()
+        self.assertGreaterEqual(renew.call_count, 2)
+
+    def test_expired_lease_is_taken_over(self):
+        ConversionLease.objects.create(music=self.music, target_extension='ogg', settings_key=self.key,
+                                       holder='crashed', expires_at=timezone.now() - timedelta(seconds=1))
+        token = ConversionLease.acquire(self.music, 'ogg', self.key)
+        self.assertIsNotNone(token)
+        self.assertEqual(ConversionLease.objects.get().holder, token)
+
+
+class ConversionRetryTests(TestCase):
+    def setUp(self):
+        self.music = Music.objects.create(title='Song', original_file='music/original/a.m4a', target_extension='mp3')
+
+    def test_classify_failure(self):
+        self.assertEqual(classify_failure(-9, ''), ConversionError.TRANSIENT)
+        self.assertEqual(classify_failure(1, 'av_interleaved_write_frame(): No space left on device'),
+                         ConversionError.TRANSIENT)
+        self.assertEqual(classify_failure(1, 'a.m4a: Invalid data found when processing input'),
+                         ConversionError.CORRUPT_INPUT)
+        self.assertEqual(classify_failure(1, 'Unknown encoder \'libmp3lame\''), ConversionError.UNSUPPORTED_CODEC)
+        self.assertEqual(classify_failure(1, 'something else'), ConversionError.UNKNOWN)
+
+    @override_settings(CONVERSION_RETRY={'base_delay': 0})
+    def test_transient_failure_is_retried(self):
+        failures = [ConversionError('killed', ConversionError.TRANSIENT), None]
+
+        def convert(path, output_format):
+            error = failures.pop(0)
+            if error:
+                raise error
+            return b'audio'
+
+        with mock.patch('music_app.models.convert_audio', side_effect=convert), \
+                mock.patch.object(self.music.converted_file, 'save'):
+            self.assertTrue(self.music.convert_audio_file())
+        self.assertEqual(list(ConversionAttempt.objects.order_by('attempt').values_list('outcome', flat=True)),
+                         ['transient', 'success'])
+        self.assertEqual(retry_stats()[0]['retry_rate'], 1.0)
+
+    def test_corrupt_input_is_not_retried(self):
+        error = ConversionError('bad file', ConversionError.CORRUPT_INPUT)
+        with mock.patch('music_app.models.convert_audio', side_effect=error) as convert:
+            self.assertFalse(self.music.convert_audio_file())
+        self.assertEqual(convert.call_count, 1)
+        self.music.refresh_from_db()
+        self.assertEqual(self.music.conversion_status, 'failed')
+        self.assertIn('corrupt_input', self.music.error_message)
+
+    @override_settings(CONVERSION_RETRY={'max_attempts': 0})
+    def test_zero_max_attempts_still_tries_once(self):
+        error = ConversionError('bad file', ConversionError.CORRUPT_INPUT)
+        with mock.patch('music_app.models.convert_audio', side_effect=error) as convert:
+            self.assertIs(self.music.convert_audio_file(), False)
+        self.assertEqual(convert.call_count, 1)
+
+
+class WavFastPathTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.samples = np.array([[0, 32767], [-32768, 256], [1000, -1000]], dtype=np.int16)
+
+    def write(self, name, data, sampwidth):
+        path = os.path.join(self.tmpdir.name, name)
+        with wave.open(path, 'wb') as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(sampwidth)
+            wav.setframerate(22050)
+            wav.writeframes(data)
+        return path
+
+    def convert(self, path, sampwidth):
+        self.assertTrue(can_convert_in_process(path, 'wav'))
+        with mock.patch('music_app.converters.convert_audio_with_pydub') as pydub:
+            output = convert_audio(path, 'wav')
+        pydub.assert_not_called()
+        with wave.open(output, 'rb') as wav:
+            self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (2, sampwidth, 22050))
+            return wav.readframes(wav.getnframes())
+
+    def test_16_bit_is_copied_unchanged(self):
+        path = self.write('a.wav', self.samples.tobytes(), 2)
+        self.assertEqual(self.convert(path, 2), self.samples.tobytes())
+
+    def test_24_bit_keeps_its_bit_depth(self):
+        wide = self.samples.astype(np.int32) * 256 + 0x7F
+        data = wide.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        path = self.write('b.wav', data, 3)
+        self.assertEqual(self.convert(path, 3), data)
+
+    def test_other_targets_are_not_eligible(self):
+        path = self.write('c.wav', self.samples.tobytes(), 2)
+        self.assertFalse(can_convert_in_process(path, 'flac'))
+
+    def test_settings_key_follows_the_converter_that_runs(self):
+        path = self.write('d.wav', self.samples.tobytes(), 2)
+        other = os.path.join(self.tmpdir.name, 'd.mp3')
+        self.assertEqual(conversion_method(path, 'wav')[0], 'in_process')
+        self.assertEqual(conversion_method(other, 'mp3'), ('pydub', {'format': 'mp3', 'bitrate': '192k'}))
+        self.assertNotEqual(conversion_settings_key('wav', path), conversion_settings_key('wav', other))
+
+
+class ResourceAccountingTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(media.name, 'music', 'original'))
+        with open(os.path.join(media.name, 'music', 'original', 'a.mp3'), 'wb') as f:
+            f.write(b'x' * 2048)
+        self.music = Music.objects.create(title='Song', original_file='music/original/a.mp3')
+        # Write buffered download counts while the test database still exists
+        self.addCleanup(flush_access)
+
+    @override_settings(REQUEST_ACCOUNTING={'slow_request_ms': 0, 'memory_sample_rate': 1,
+                                           'server_timing_headers': {'HTTP_X_TIMING_TOKEN': 'secret'}})
+    def test_server_timing_and_slow_request_log(self):
+        with self.assertLogs('music_app.middleware', 'WARNING') as logs:
+            response = self.client.get(f'/download-original/{self.music.pk}/', HTTP_X_TIMING_TOKEN='secret')
+        b''.join(response.streaming_content)
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn('cpu;dur=', timing)
+        self.assertIn('db;dur=', timing)
+        self.assertIn('read 2KB', timing)
+        self.assertIn('mem;desc="peak +', timing)
+        self.assertIn(f'/download-original/{self.music.pk}/', logs.output[0])
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.assertNotIn('Server-Timing', self.client.get('/'))
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertIn('Server-Timing', self.client.get('/'))
+
+
+class AccessTrackingTests(TestCase):
+    def setUp(self):
+        flush_access()
+        self.addCleanup(flush_access)
+        self.hot = Music.objects.create(title='Hot', original_file='music/original/a.mp3')
+        self.cold = Music.objects.create(title='Cold', original_file='music/original/b.mp3',
+                                         conversion_status='success', converted_file='music/converted/b.mp3',
+                                         converted_at=timezone.now() - timedelta(days=90))
+
+    @override_settings(ACCESS_TRACKING={'flush_interval': 3600, 'flush_threshold': 1000})
+    def test_accesses_are_buffered_then_flushed(self):
+        for _ in range(3):
+            record_access(self.hot.pk)
+        record_access(self.hot.pk, original=True)
+        self.assertFalse(TrackPopularity.objects.exists())
+        flush_access()
+        popularity = TrackPopularity.objects.get(music=self.hot)
+        self.assertEqual((popularity.downloads, popularity.original_downloads), (3, 1))
+        self.assertIsNotNone(popularity.trend_score)
+
+    def test_warming_converts_hot_and_evicts_cold(self):
+        record_access(self.hot.pk)
+        out = StringIO()
+        tracked = {'tracking_started': timezone.now() - timedelta(days=60)}
+        with mock.patch.object(Music, 'convert_audio_file', return_value=False) as convert, \
+                override_settings(RENDITION_WARMING=tracked):
+            call_command('warm_renditions', '--force', stdout=out)
+        convert.assert_called_once()
+        self.cold.refresh_from_db()
+        self.assertEqual(self.cold.conversion_status, 'pending')
+        self.assertFalse(self.cold.converted_file)
+
+    def test_untracked_rendition_is_kept_until_tracking_has_run_long_enough(self):
+        # Tracking began when the test database was migrated, moments ago
+        call_command('warm_renditions', '--force', stdout=StringIO())
+        self.cold.refresh_from_db()
+        self.assertEqual(self.cold.conversion_status, 'success')
+
+    def test_off_peak_window_can_wrap_past_midnight(self):
+        self.assertTrue(in_off_peak_window(23, 22, 5))
+        self.assertTrue(in_off_peak_window(2, 22, 5))
+        self.assertFalse(in_off_peak_window(12, 22, 5))
+        self.assertTrue(in_off_peak_window(3, 1, 6))
+        self.assertFalse(in_off_peak_window(6, 1, 6))
+
+    def test_evicted_cold_track_is_not_warmed_again(self):
+        TrackPopularity.objects.create(music=self.cold, downloads=5, hot_score=1.0, trend_score=1.0,
+                                       last_accessed_at=timezone.now() - timedelta(days=40))
+        with mock.patch.object(Music, 'convert_audio_file', return_value=False) as convert:
+            call_command('warm_renditions', '--force', stdout=StringIO())
+        convert.assert_not_called()
+        self.cold.refresh_from_db()
+        self.assertEqual(self.cold.conversion_status, 'pending')
+
+
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.music = Music.objects.create(title='Cached Song', original_file='music/original/a.mp3')
+
+    def test_row_fragment_is_reused_until_the_row_is_saved(self):
+        self.assertContains(self.client.get('/'), 'Cached Song')
+        # update() skips save(), so the version and cached fragment stay put
+        Music.objects.filter(pk=self.music.pk).update(title='Renamed')
+        self.assertContains(self.client.get('/'), 'Cached Song')
+        self.music.refresh_from_db()
+        self.music.title = 'Renamed'
+        self.music.save(update_fields=['title'])
+        self.assertContains(self.client.get('/'), 'Renamed')
+
+    def test_unchanged_list_answers_304_with_one_query(self):
+        # The first visit sets the CSRF cookie, which is part of the ETag
+        self.client.get('/')
+        response = self.client.get('/')
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.music.title = 'Edited'
+        self.music.save(update_fields=['title'])
+        self.assertEqual(self.music.version, 2)
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get('/')['ETag']
+
+        self.music.delete()
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertNotEqual(self.client.get('/?q=song', HTTP_IF_NONE_MATCH=etag).status_code, 304)
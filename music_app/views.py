@@ -5,16 +5,33 @@ from django.contrib import messages
 from django.urls import reverse
 from .models import Music
 from .forms import MusicUploadForm, MusicConvertForm
+from .fingerprint import reuse_duplicate_conversion
+from .search import search_music
+from .scheduler import async_uploads_enabled, client_for_request, enqueue
+from .access import record_access
+from .render_cache import get_config as get_render_cache_config, music_list_etag, music_list_last_modified
 import os
 import re
 from django.http import JsonResponse
 
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.utils.decorators import method_decorator
 
+# Browsers must revalidate, so an unchanged list costs one aggregate query and a 304
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=music_list_etag, last_modified_func=music_list_last_modified)
 def music_list(request):
+    query = request.GET.get('q', '').strip()
     music_files = Music.objects.all().order_by('-uploaded_at')
-    return render(request, 'music_app/music_list.html', {'music_files': music_files})
+    if query:
+        music_files = search_music(music_files, query)
+    return render(request, 'music_app/music_list.html', {
+        'music_files': music_files,
+        'query': query,
+        'fragment_timeout': get_render_cache_config()['timeout'],
+    })
 
 @csrf_exempt
 def iphone_upload_api(request):
@@ -50,13 +67,20 @@ def iphone_upload_api(request):
             )
             music.original_file.save(file.name, file, save=False)
             music.save()
+            if async_uploads_enabled():
+                # The worker fingerprints the upload before converting it
+                enqueue(music, 'api', client_for_request(request))
+            elif not reuse_duplicate_conversion(music):
+                # No worker is assumed to be running, so convert inline
+                music.convert_audio_file()
             
             # Return success response
             return JsonResponse({
                 'success': True,
                 'message': 'File uploaded successfully',
                 'id': music.id,
-                'title': music.title
+                'title': music.title,
+                'conversion_status': music.conversion_status
             })
             
         except Exception as e:
@@ -90,7 +114,12 @@ def upload_music(request):
                 
                 # Try to convert immediately after upload
                 try:
-                    if music.convert_audio_file():
+                    if async_uploads_enabled():
+                        enqueue(music, 'interactive', client_for_request(request))
+                        messages.info(request, f'Conversion to {music.target_extension.upper()} has been queued.')
+                    elif reuse_duplicate_conversion(music):
+                        messages.success(request, f'This track was already converted to {music.target_extension.upper()}; reused the existing file.')
+                    elif music.convert_audio_file():
                         messages.success(request, f'Music file converted to {music.target_extension.upper()} successfully!')
                     else:
                         messages.warning(request, 'File uploaded but conversion failed. You can try converting it manually.')
@@ -157,7 +186,12 @@ def handle_iphone_upload(request):
         
         # Try conversion
         try:
-            if music.convert_audio_file():
+            if async_uploads_enabled():
+                enqueue(music, 'interactive', client_for_request(request))
+                messages.info(request, f'Conversion to {music.target_extension.upper()} has been queued.')
+            elif reuse_duplicate_conversion(music):
+                messages.success(request, f'This track was already converted to {music.target_extension.upper()}; reused the existing file.')
+            elif music.convert_audio_file():
                 messages.success(request, f'Music file converted to {music.target_extension.upper()} successfully!')
         except Exception as e:
             messages.warning(request, f'File uploaded but conversion failed: {str(e)}')
@@ -177,7 +211,10 @@ def convert_music(request, pk):
             form.save()
             
             # Convert the audio file
-            if music.convert_audio_file():
+            if async_uploads_enabled():
+                enqueue(music, 'interactive', client_for_request(request))
+                messages.info(request, f'Conversion to {music.target_extension.upper()} has been queued.')
+            elif music.convert_audio_file():
                 messages.success(request, f'Music file converted to {music.target_extension.upper()} successfully!')
             else:
                 messages.error(request, f'Error converting music file: {music.error_message}')
@@ -190,12 +227,13 @@ def convert_music(request, pk):
 
 def download_music(request, pk):
     music = get_object_or_404(Music, pk=pk)
+    # Counted even when there is nothing to download yet: it is still demand
+    record_access(music.pk)
     
     if music.converted_file and music.conversion_status == 'success':
-        file_path = music.converted_file.path
-        filename = os.path.basename(file_path)
+        filename = os.path.basename(music.converted_file.name)
         
-        response = FileResponse(open(file_path, 'rb'))
+        response = FileResponse(music.converted_file.open('rb'))
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
     else:
@@ -209,7 +247,7 @@ def delete_music(request, pk):
         # Delete associated files
         if music.original_file:
             music.original_file.delete()
-        if music.converted_file:
+        if music.converted_file and not music.converted_file_is_shared():
             music.converted_file.delete()
         
         # Delete the database record
@@ -222,12 +260,12 @@ def delete_music(request, pk):
 
 def download_original(request, pk):
     music = get_object_or_404(Music, pk=pk)
+    record_access(music.pk, original=True)
     
     if music.original_file:
-        file_path = music.original_file.path
-        filename = os.path.basename(file_path)
+        filename = os.path.basename(music.original_file.name)
         
-        response = FileResponse(open(file_path, 'rb'))
+        response = FileResponse(music.original_file.open('rb'))
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
     else:
@@ -44,7 +44,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its measurements cover every other middleware
+    'music_app.middleware.ResourceAccountingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Must run before anything that reads the request body (CSRF, sessions)
+    'music_app.middleware.UploadAdmissionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,12 +81,55 @@ WSGI_APPLICATION = 'music_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# SQLite is the default. Set DATABASE_ENGINE=postgresql (plus the POSTGRES_*
+# variables below) to run against PostgreSQL with persistent connections.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'music_converter'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep connections open between requests instead of reconnecting
+            # every time; health checks drop connections the server closed.
+            'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            # Required when connecting through PgBouncer in transaction mode.
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER', '') == '1',
+            'OPTIONS': {
+                'connect_timeout': 10,
+            },
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Seconds to wait on a locked database before raising
+                # "database is locked".
+                'timeout': 20,
+            },
+        }
+    }
+
+# Pragmas applied to every new SQLite connection (see music_app/signals.py).
+# WAL lets readers and a writer work concurrently; synchronous=NORMAL is safe
+# with WAL and avoids an fsync per commit.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 20000,  # milliseconds
+    'temp_store': 'memory',
+    'cache_size': -20000,  # negative means KiB, so ~20MB
+    'foreign_keys': 'on',
 }
 
 
@@ -132,6 +179,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    # Reports bytes read and written to ResourceAccountingMiddleware
+    'default': {
+        'BACKEND': 'music_app.storage.InstrumentedFileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Jazzmin Settings
@@ -181,3 +238,89 @@ if not DEBUG:
     SECURE_HSTS_SECONDS = 31536000  # 1 year
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
+
+# Acoustic fingerprinting of uploads (see music_app/fingerprint.py). A new
+# upload that matches an already converted track reuses its converted file.
+AUDIO_FINGERPRINT = {
+    'enabled': True,
+    'max_seconds': 120,
+    'max_bit_error_rate': 0.35,
+}
+
+# Full-text search on title and artist (see music_app/search.py)
+MUSIC_SEARCH = {
+    'max_results': 200,
+}
+
+# Conversion queue (see music_app/scheduler.py). Uploads convert inline
+# unless async_uploads is set; with it set, and for the admin's "Queue
+# reconversion" action, `python manage.py run_conversion_worker` must be
+# running or queued jobs are never converted.
+CONVERSION_SCHEDULER = {
+    'async_uploads': False,
+    'aging_seconds': 300,
+    'fair_share_seconds': 600,
+}
+
+# Admission control for upload endpoints (see music_app/admission.py).
+# In-flight counters live in the default cache; configure a shared cache
+# (Redis, Memcached) for the limits to apply across gunicorn workers.
+# Clients are keyed by address; behind a reverse proxy, set client_ip_header
+# or every client shares the proxy's per-client limit.
+UPLOAD_ADMISSION = {
+    'max_in_flight': 20,
+    'max_in_flight_per_client': 2,
+    'max_backlog': 200,
+    'workers': 1,
+    'min_free_bytes': 500 * 1024 * 1024,
+    'client_ip_header': os.environ.get('UPLOAD_CLIENT_IP_HEADER') or None,
+}
+
+# Single-flight conversions (see ConversionLease in music_app/models.py).
+# The holder renews its lease every third of lease_seconds while converting,
+# so a lease left unrenewed for lease_seconds belongs to a dead worker.
+CONVERSION_LEASE = {
+    'lease_seconds': 900,
+    'poll_interval': 0.5,
+}
+
+# Retries of failed conversions. Only transient failures (out of memory or
+# disk, FFmpeg killed) are retried; corrupt input and unsupported codecs fail
+# immediately.
+CONVERSION_RETRY = {
+    'max_attempts': 3,
+    'base_delay': 1.0,
+    'max_delay': 30.0,
+}
+
+# Per-request cost accounting (see ResourceAccountingMiddleware). Requests
+# slower than slow_request_ms are logged; memory_sample_rate is the share of
+# requests traced with tracemalloc. The Server-Timing breakdown is only sent
+# when DEBUG is on, to staff users, or to requests matching
+# server_timing_headers.
+REQUEST_ACCOUNTING = {
+    'slow_request_ms': 1000,
+    'memory_sample_rate': 0.01,
+    'server_timing_staff': True,
+    'server_timing_headers': {},
+}
+
+# Download tracking (see music_app/access.py) and rendition warming, run
+# periodically with `python manage.py warm_renditions`
+ACCESS_TRACKING = {
+    'flush_interval': 30,
+    'flush_threshold': 500,
+}
+
+RENDITION_WARMING = {
+    'off_peak_hours': (1, 6),
+    'cpu_seconds': 600,
+    'max_storage_bytes': 5 * 1024 ** 3,
+    'cold_days': 30,
+}
+
+# Rendered music list cards and admin changelist cells, cached per row
+# version in the default cache (see music_app/render_cache.py)
+RENDER_CACHE = {
+    'timeout': 3600,
+}